@@ -5,7 +5,7 @@ Then open: http://localhost:5000
 """
 
 try:
-    from flask import Flask, request, jsonify, render_template_string
+    from flask import Flask, Response, request, jsonify, render_template_string
     from flask_cors import CORS
     FLASK_AVAILABLE = True
 except ImportError:
@@ -13,16 +13,91 @@ except ImportError:
     print("Flask not installed. Run: pip install flask flask-cors")
     exit(1)
 
-from paraphraser import AIParaphraser
+from scheduler import Overloaded
+from serving import (
+    instrument, jobs_from_env, metrics_response, overloaded_response, paraphraser_from_env,
+    scheduler_from_env,
+)
+import json
 import os
+import threading
 
 app = Flask(__name__)
 CORS(app)
+instrument(app)
+
+# The paraphraser is loaded once per process by init_paraphraser(): at startup
+# when run directly, or by the serve.py master before it forks workers. When
+# another server imports `app:app`, the first /health check starts loading it
+# in the background (see start_loading).
+# It is configured through PARAPHRASER_* environment variables, see serving.py.
+# Requests go through the scheduler, which batches concurrent ones together.
+# Long documents can be submitted as jobs, run in the background by `jobs`.
+paraphraser = None
+scheduler = None
+jobs = None
+_paraphraser_lock = threading.Lock()
+_loader = None
+_loader_lock = threading.Lock()
+# Why the last background load failed, if it did
+_load_error = None
+
+# Most texts accepted by one /api/paraphrase/batch request
+MAX_BATCH_ITEMS = 1000
+
+
+def init_paraphraser(**options):
+    """Load the paraphraser configured by the environment (options override it)."""
+    global paraphraser, scheduler, jobs
+    print("Loading AI Paraphraser...")
+    paraphraser = paraphraser_from_env(**options)
+    scheduler = scheduler_from_env(paraphraser)
+    jobs = jobs_from_env(scheduler)
+    print("✓ Ready to paraphrase!")
+    return paraphraser
+
+
+def get_paraphraser():
+    """Return the loaded paraphraser, loading it on first use."""
+    if paraphraser is None:
+        with _paraphraser_lock:
+            if paraphraser is None:
+                init_paraphraser()
+    return paraphraser
+
+
+def start_loading():
+    """Load the paraphraser and start the job workers in a background thread, once."""
+    global _loader
+    with _loader_lock:
+        if paraphraser is None and (_loader is None or not _loader.is_alive()):
+            _loader = threading.Thread(target=_load, name="paraphraser-loader", daemon=True)
+            _loader.start()
+
+
+def _load():
+    global _load_error
+    try:
+        get_jobs()
+        _load_error = None
+    except Exception as e:
+        # Reported by /health, which tries again on the next check
+        print(f"Loading the paraphraser failed: {e}")
+        _load_error = e
+
+
+def get_scheduler():
+    """Return the request scheduler, loading the paraphraser on first use."""
+    get_paraphraser()
+    return scheduler
+
+
+def get_jobs():
+    """Return the job runner, starting its workers on first use."""
+    get_paraphraser()
+    jobs.start()
+    return jobs
 
-# Initialize paraphraser (loaded once at startup)
-print("Loading AI Paraphraser...")
-paraphraser = AIParaphraser()
-print("✓ Ready to paraphrase!")
 
 # Modern, clean HTML interface
 HTML_TEMPLATE = """
@@ -266,6 +341,11 @@ HTML_TEMPLATE = """
             flex: 1;
         }
         
+        .result-item.sentence-item {
+            border-left-color: #c3c8f0;
+            opacity: 0.8;
+        }
+        
         .copy-btn {
             background: none;
             border: 2px solid #667eea;
@@ -357,7 +437,7 @@ HTML_TEMPLATE = """
         
         <div class="loading" id="loading">
             <div class="spinner"></div>
-            <p>Generating paraphrases...</p>
+            <p id="loadingText">Generating paraphrases...</p>
         </div>
         
         <div class="error" id="error"></div>
@@ -399,12 +479,16 @@ HTML_TEMPLATE = """
             
             // Show loading
             document.getElementById('loading').classList.add('active');
+            document.getElementById('loadingText').textContent = 'Generating paraphrases...';
             document.getElementById('results').classList.remove('active');
             document.getElementById('error').classList.remove('active');
+            document.getElementById('resultsList').innerHTML = '';
+            document.getElementById('resultsCount').textContent = '';
             document.getElementById('generateBtn').disabled = true;
             
             try {
-                const response = await fetch('/api/paraphrase', {
+                // Results are streamed as Server-Sent Events and shown as they arrive
+                const response = await fetch('/api/paraphrase/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
@@ -415,12 +499,53 @@ HTML_TEMPLATE = """
                     })
                 });
                 
-                const data = await response.json();
-                
-                if (data.error) {
+                if (!response.ok) {
+                    const data = await response.json();
                     showError(data.error);
-                } else {
-                    showResults(data.paraphrases);
+                    return;
+                }
+                
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                let count = 0;
+                
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    
+                    // Events are separated by a blank line
+                    let end;
+                    while ((end = buffer.indexOf('\n\n')) !== -1) {
+                        const frame = buffer.slice(0, end);
+                        buffer = buffer.slice(end + 2);
+                        
+                        let name = 'message';
+                        let payload = '';
+                        frame.split('\n').forEach(line => {
+                            if (line.startsWith('event: ')) name = line.slice(7);
+                            if (line.startsWith('data: ')) payload += line.slice(6);
+                        });
+                        const data = JSON.parse(payload);
+                        
+                        if (name === 'sentence') {
+                            // Paragraph mode: preview each sentence as soon as it is done
+                            const finished = document.querySelectorAll('.sentence-item').length + 1;
+                            document.getElementById('loadingText').textContent =
+                                'Paraphrased ' + finished + ' of ' + data.total + ' sentences...';
+                            addResult(data.variations[0], 'Sentence ' + (data.index + 1), 'sentence-item');
+                        } else if (name === 'paraphrase') {
+                            if (count === 0) {
+                                document.querySelectorAll('.sentence-item').forEach(item => item.remove());
+                            }
+                            count += 1;
+                            addResult(data.text, count + '.');
+                            updateCount(count);
+                        } else if (name === 'error') {
+                            showError(data.error);
+                        }
+                    }
                 }
             } catch (error) {
                 showError('Error: ' + error.message);
@@ -430,26 +555,20 @@ HTML_TEMPLATE = """
             }
         }
         
-        function showResults(paraphrases) {
-            const resultsDiv = document.getElementById('results');
-            const resultsList = document.getElementById('resultsList');
-            const resultsCount = document.getElementById('resultsCount');
-            
-            resultsList.innerHTML = '';
-            resultsCount.textContent = paraphrases.length + ' paraphrase' + (paraphrases.length !== 1 ? 's' : '');
-            
-            paraphrases.forEach((para, index) => {
-                const item = document.createElement('div');
-                item.className = 'result-item';
-                item.innerHTML = `
-                    <span class="result-number">${index + 1}.</span>
-                    <span class="result-text">${escapeHtml(para)}</span>
-                    <button class="copy-btn" onclick="copyText('${escapeHtml(para).replace(/'/g, "\\'")}')">Copy</button>
-                `;
-                resultsList.appendChild(item);
-            });
-            
-            resultsDiv.classList.add('active');
+        function addResult(para, label, extraClass) {
+            const item = document.createElement('div');
+            item.className = 'result-item' + (extraClass ? ' ' + extraClass : '');
+            item.innerHTML = `
+                <span class="result-number">${escapeHtml(label)}</span>
+                <span class="result-text">${escapeHtml(para)}</span>
+                <button class="copy-btn" onclick="copyText('${escapeHtml(para).replace(/'/g, "\\'")}')">Copy</button>
+            `;
+            document.getElementById('resultsList').appendChild(item);
+            document.getElementById('results').classList.add('active');
+        }
+        
+        function updateCount(count) {
+            document.getElementById('resultsCount').textContent = count + ' paraphrase' + (count !== 1 ? 's' : '');
         }
         
         function showError(message) {
@@ -480,45 +599,110 @@ def home():
     """Serve the web interface"""
     return render_template_string(HTML_TEMPLATE)
 
+def parse_request(data):
+    """Validate a paraphrase request body, raising ValueError with the message for the client."""
+    if not data or 'text' not in data:
+        raise ValueError('No text provided')
+    
+    text = data['text']
+    num_paraphrases = data.get('num_paraphrases', 5)
+    seed = data.get('seed')  # Optional: reproducible (cacheable) output
+    
+    # Validate parameters
+    if not text.strip():
+        raise ValueError('Text cannot be empty')
+    
+    if num_paraphrases < 1 or num_paraphrases > 20:
+        raise ValueError('num_paraphrases must be between 1 and 20')
+    
+    if seed is not None and not isinstance(seed, int):
+        raise ValueError('seed must be an integer')
+    
+    return text, num_paraphrases, seed
+
+
+def is_paragraph(text):
+    """Auto-detect if text is a paragraph and should use paragraph mode"""
+    # Check for multiple sentences using periods, semicolons, and overall length
+    sentence_markers = text.count('.') + text.count(';') + text.count('!')  + text.count('?')
+    word_count = len(text.split())
+    return sentence_markers >= 2 or word_count > 30
+
+
+def parse_batch_items(body, ndjson):
+    """
+    Parse a /api/paraphrase/batch body: a JSON array, or one JSON value per line.
+    
+    Items are strings or {"text": ..., "id": ...} objects. Invalid items get an
+    'error' instead of a 'text' so they can be reported on their own; only a
+    body that isn't a JSON array at all raises ValueError.
+    """
+    if ndjson:
+        raw = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                raw.append(json.loads(line))
+            except ValueError as e:
+                raw.append(ValueError(f'Invalid JSON: {e}'))
+    else:
+        try:
+            raw = json.loads(body)
+        except ValueError as e:
+            raise ValueError(f'Invalid JSON: {e}')
+        if not isinstance(raw, list):
+            raise ValueError('Expected a JSON array of texts')
+    
+    items = []
+    for index, item in enumerate(raw):
+        entry = {'index': index}
+        if isinstance(item, dict):
+            if 'id' in item:
+                entry['id'] = item['id']
+            item = item.get('text')
+        if isinstance(item, ValueError):
+            entry['error'] = str(item)
+        elif not isinstance(item, str) or not item.strip():
+            entry['error'] = 'text must be a non-empty string'
+        else:
+            entry['text'] = item
+        items.append(entry)
+    return items
+
+
+def sse_event(name, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
 @app.route('/api/paraphrase', methods=['POST'])
 def api_paraphrase():
     """API endpoint for paraphrasing"""
     try:
-        data = request.json
-        
-        if not data or 'text' not in data:
-            return jsonify({'error': 'No text provided'}), 400
-        
-        text = data['text']
-        num_paraphrases = data.get('num_paraphrases', 5)
-        
-        # Validate parameters
-        if not text.strip():
-            return jsonify({'error': 'Text cannot be empty'}), 400
-        
-        if num_paraphrases < 1 or num_paraphrases > 20:
-            return jsonify({'error': 'num_paraphrases must be between 1 and 20'}), 400
-        
-        # Auto-detect if text is a paragraph and use appropriate method
-        # Check for multiple sentences using periods, semicolons, and overall length
-        sentence_markers = text.count('.') + text.count(';') + text.count('!')  + text.count('?')
-        word_count = len(text.split())
+        try:
+            text, num_paraphrases, seed = parse_request(request.json)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        if sentence_markers >= 2 or word_count > 30:
+        scheduler = get_scheduler()
+        if is_paragraph(text):
             # Longer text with multiple sentences - use paragraph mode
-            paraphrases = paraphraser.paraphrase_paragraph(
+            paraphrases = scheduler.paraphrase_paragraph(
                 text,
                 num_paraphrases=num_paraphrases,
                 temperature=1.0,
-                max_length=256
+                max_length=256,
+                seed=seed
             )
         else:
             # Short text or single sentence - use regular mode
-            paraphrases = paraphraser.paraphrase(
+            paraphrases = scheduler.paraphrase(
                 text,
                 num_paraphrases=num_paraphrases,
                 temperature=1.0,
-                max_length=512
+                max_length=512,
+                seed=seed
             )
         
         return jsonify({
@@ -527,13 +711,221 @@ def api_paraphrase():
             'count': len(paraphrases)
         })
     
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/paraphrase/stream', methods=['POST'])
+def api_paraphrase_stream():
+    """
+    Streaming API endpoint: Server-Sent Events sent as results are ready
+    
+    Events: 'sentence' for each finished sentence (paragraph mode), then
+    'paraphrase' for each result, and finally 'done' (or 'error').
+    """
+    try:
+        text, num_paraphrases, seed = parse_request(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    paragraph = is_paragraph(text)
+    options = dict(temperature=1.0, max_length=256 if paragraph else 512)
+    if paragraph and seed is None:
+        # The first sentence runs on its own so it shows up quickly; the rest
+        # still share one batch. Seeded requests keep the single batch to
+        # match /api/paraphrase.
+        options['first_alone'] = True
+    
+    try:
+        events = get_scheduler().stream(
+            text, num_paraphrases=num_paraphrases, seed=seed, paragraph=paragraph, **options
+        )
+    except Overloaded as e:
+        return overloaded_response(e)
+    
+    def generate():
+        count = 0
+        try:
+            for event in events:
+                if event['type'] == 'paraphrase':
+                    count += 1
+                yield sse_event(event['type'], event)
+            yield sse_event('done', {'original': text, 'count': count})
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+        finally:
+            events.close()
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/paraphrase/batch', methods=['POST'])
+def api_paraphrase_batch():
+    """
+    Bulk API endpoint: paraphrase many texts in one request
+    
+    The body is a JSON array or NDJSON (Content-Type: application/x-ndjson) of
+    texts or {"text", "id"} objects; num_paraphrases, seed and ordered=1 go in
+    the query string. The response is NDJSON with one line per input, sent as
+    each text finishes (or in input order with ordered=1), carrying its index
+    (and id) with either its paraphrases or an error.
+    """
+    num_paraphrases = request.args.get('num_paraphrases', 5, type=int)
+    seed = request.args.get('seed', type=int)
+    ordered = request.args.get('ordered', '') not in ('', '0')
+    
+    if num_paraphrases < 1 or num_paraphrases > 20:
+        return jsonify({'error': 'num_paraphrases must be between 1 and 20'}), 400
+    
+    ndjson = 'ndjson' in request.mimetype
+    try:
+        items = parse_batch_items(request.get_data(as_text=True), ndjson)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'At most {MAX_BATCH_ITEMS} texts per request'}), 400
+    
+    valid = [item for item in items if 'text' in item]
+    events = None
+    if valid:
+        try:
+            events = get_scheduler().stream_many(
+                [item['text'] for item in valid],
+                num_paraphrases=num_paraphrases,
+                seed=seed,
+                temperature=1.0,
+                max_length=512,
+            )
+        except Overloaded as e:
+            return overloaded_response(e)
+    
+    def result(item, **fields):
+        line = {key: item[key] for key in ('index', 'id') if key in item}
+        line.update(fields)
+        return line
+    
+    def generate():
+        ready = {}
+        next_index = 0
+        
+        def emit(line):
+            nonlocal next_index
+            if not ordered:
+                yield json.dumps(line) + '\n'
+                return
+            # Hold lines back until every earlier input has been sent
+            ready[line['index']] = line
+            while next_index in ready:
+                yield json.dumps(ready.pop(next_index)) + '\n'
+                next_index += 1
+        
+        for item in items:
+            if 'error' in item:
+                yield from emit(result(item, error=item['error']))
+        
+        finished = set()
+        try:
+            for event in events or ():
+                item = valid[event['index']]
+                finished.add(event['index'])
+                if 'error' in event:
+                    yield from emit(result(item, error=event['error']))
+                    continue
+                yield from emit(
+                    result(item, original=item['text'], paraphrases=event['paraphrases'])
+                )
+        except Exception as e:
+            for position, item in enumerate(valid):
+                if position not in finished:
+                    yield from emit(result(item, error=str(e)))
+        finally:
+            if events is not None:
+                events.close()
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/jobs', methods=['POST'])
+def api_submit_job():
+    """Submit a long document to be paraphrased in the background"""
+    try:
+        text, num_paraphrases, seed = parse_request(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        job_id = get_jobs().submit(
+            text, num_paraphrases=num_paraphrases, seed=seed, temperature=1.0, max_length=256
+        )
+    except Overloaded as e:
+        return overloaded_response(e)
+    
+    url = f'/api/jobs/{job_id}'
+    return jsonify({'id': job_id, 'status': 'queued', 'url': url}), 202, {'Location': url}
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """Job status and progress (sentences done out of total)"""
+    job = get_jobs().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    status = {
+        'id': job_id,
+        'status': job['status'],
+        'progress': {'done': job['done'], 'total': job['total']},
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+    }
+    if 'position' in job:
+        status['position'] = job['position']
+    if job['status'] == 'done':
+        status['result_url'] = f'/api/jobs/{job_id}/result'
+    if job['error'] is not None:
+        status['error'] = job['error']
+    return jsonify(status)
+
+@app.route('/api/jobs/<job_id>/result')
+def api_job_result(job_id):
+    """Paraphrases of a finished job (202 while it is still queued or running)"""
+    job = get_jobs().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error']}), 500
+    if job['status'] != 'done':
+        return jsonify({'id': job_id, 'status': job['status']}), 202
+    
+    return jsonify({
+        'id': job_id,
+        'paraphrases': job['result'],
+        'count': len(job['result'])
+    })
+
 @app.route('/health')
 def health():
-    """Health check endpoint"""
-    return jsonify({'status': 'healthy'})
+    """Health check endpoint (503 while loading, warming up or overloaded)"""
+    if paraphraser is None or not paraphraser.ready:
+        # Imported by another server, nothing has loaded the model yet
+        start_loading()
+        if _load_error is not None:
+            return jsonify({'status': 'failed', 'error': str(_load_error)}), 503
+        return jsonify({'status': 'starting'}), 503
+    stats = scheduler.stats()
+    if stats['saturated']:
+        headers = {'Retry-After': str(scheduler.retry_after())}
+        return jsonify({'status': 'overloaded', 'batching': stats}), 503, headers
+    return jsonify({'status': 'healthy', 'batching': stats, 'jobs': jobs.stats()})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this process (stage latencies, tokens, queue, caches)"""
+    return metrics_response(paraphraser, scheduler, jobs)
 
 if __name__ == "__main__":
     # Port can be set via environment variable or command line argument
@@ -551,6 +943,9 @@ if __name__ == "__main__":
     else:
         port = int(os.environ.get('PORT', 8080))  # Changed default to 8080
     
+    init_paraphraser()
+    jobs.start()
+    
     print("\n" + "=" * 70)
     print("🌐 AI Paraphraser Web Interface")
     print("=" * 70)
@@ -0,0 +1,351 @@
+"""
+Caches used by the paraphraser to avoid repeating work
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+
+DEFAULT_DISK_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "paraphraser", "results.sqlite3"
+)
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by total size in bytes.
+
+    Every entry is stored together with its size; when the total goes over
+    `max_bytes` (or the entry count over `max_entries`) the least recently
+    used entries are evicted. Entries can optionally expire after `ttl`
+    seconds. Hits and misses are counted so callers can report the hit ratio.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        """
+        Args:
+            max_bytes: Maximum total size of cached values (0 disables the cache)
+            max_entries: Optional maximum number of entries
+            ttl: Optional lifetime of an entry in seconds
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.max_entries != 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for `key` (marking it recently used), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                # Expired: drop it and treat as a miss
+                del self._entries[key]
+                self._bytes -= entry[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: int) -> None:
+        """Store `value` under `key`, evicting old entries to stay within bounds."""
+        if not self.enabled or nbytes > self.max_bytes:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            self._entries[key] = (value, nbytes, expires_at)
+            self._bytes += nbytes
+
+            while self._entries and (
+                self._bytes > self.max_bytes
+                or (self.max_entries is not None and len(self._entries) > self.max_entries)
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[1]
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every entry (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class EncoderCache(LRUCache):
+    """
+    Cache of tokenized inputs and encoder hidden states.
+
+    Keys are (model name, input text); values are (input_ids, hidden_states)
+    where `hidden_states` has shape (num_tokens, hidden_size) without padding.
+    Entries are sized by the memory their tensors occupy.
+    """
+
+    def __init__(self, max_mb: float = 64.0):
+        """
+        Args:
+            max_mb: Memory budget in megabytes (0 disables the cache)
+        """
+        super().__init__(max_bytes=int(max_mb * 1024 * 1024))
+
+    def put_encoding(self, model_name: str, text: str, input_ids, hidden_states) -> None:
+        """Store the token ids and unpadded hidden states for `text`."""
+        nbytes = hidden_states.element_size() * hidden_states.nelement() + 8 * len(input_ids)
+        self.put((model_name, text), (list(input_ids), hidden_states), nbytes)
+
+    def get_encoding(self, model_name: str, text: str):
+        """Return (input_ids, hidden_states) for `text`, or None."""
+        return self.get((model_name, text))
+
+
+class ResultCache(LRUCache):
+    """
+    Cache of finished paraphrase lists for seeded (reproducible) requests.
+
+    Bounded by entry count and bytes, with a time-to-live so stale results
+    are eventually regenerated. Keys are built with `make_key`.
+    """
+
+    def __init__(
+        self, max_entries: int = 1024, max_mb: float = 16.0, ttl: Optional[float] = 3600.0
+    ):
+        """
+        Args:
+            max_entries: Maximum number of cached results (0 disables the cache)
+            max_mb: Memory budget in megabytes
+            ttl: Lifetime of a cached result in seconds (None = no expiry)
+        """
+        super().__init__(max_bytes=int(max_mb * 1024 * 1024), max_entries=max_entries, ttl=ttl)
+
+    @staticmethod
+    def make_key(mode: str, model_name: str, text: str, params: Dict[str, Any], seed: int) -> tuple:
+        """Build a cache key from everything that determines a seeded result."""
+        normalized = ' '.join(text.split())
+        return (mode, model_name, normalized, tuple(sorted(params.items())), seed)
+
+    def put_result(self, key: tuple, paraphrases: List[str]) -> None:
+        """Store a copy of `paraphrases` under `key`."""
+        nbytes = sum(len(p.encode('utf-8')) + 64 for p in paraphrases) + 256
+        self.put(key, list(paraphrases), nbytes)
+
+    def get_result(self, key: tuple) -> Optional[List[str]]:
+        """Return a copy of the cached paraphrases for `key`, or None."""
+        result = self.get(key)
+        return list(result) if result is not None else None
+
+
+class DiskResultCache:
+    """
+    Persistent result cache stored in a SQLite database.
+
+    Works as a second level behind ResultCache: it survives restarts and is
+    shared by every process on the machine that points at the same file
+    (CLI runs, batch jobs, web workers). The database runs in WAL mode so
+    readers never block the writer, and the least recently used rows are
+    evicted once the stored results exceed `max_mb`.
+    """
+
+    # Only refresh a row's access time when it is older than this, so that
+    # hot keys don't turn every read into a write
+    ACCESS_RESOLUTION = 60.0
+
+    def __init__(
+        self,
+        path: str = DEFAULT_DISK_CACHE_PATH,
+        max_mb: float = 256.0,
+        ttl: Optional[float] = None,
+        timeout: float = 5.0,
+    ):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+            max_mb: Size budget for stored results in megabytes
+            ttl: Optional lifetime of a stored result in seconds
+            timeout: Seconds to wait for a lock held by another process
+        """
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+        # Running total of the stored sizes, kept up to date by triggers so
+        # every process sees the same figure without summing the table
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results_usage ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO results_usage (id, bytes) "
+            "SELECT 0, COALESCE(SUM(size), 0) FROM results"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS results_usage_insert AFTER INSERT ON results BEGIN "
+            "UPDATE results_usage SET bytes = bytes + NEW.size WHERE id = 0; END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS results_usage_update AFTER UPDATE OF size ON results "
+            "BEGIN UPDATE results_usage SET bytes = bytes + NEW.size - OLD.size WHERE id = 0; END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS results_usage_delete AFTER DELETE ON results BEGIN "
+            "UPDATE results_usage SET bytes = bytes - OLD.size WHERE id = 0; END"
+        )
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, reopening it after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _hash_key(key: tuple) -> str:
+        return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def get_result(self, key: tuple) -> Optional[List[str]]:
+        """Return the stored paraphrases for `key` (a ResultCache key), or None."""
+        digest = self._hash_key(key)
+        now = time.time()
+        conn = self._connection()
+
+        row = conn.execute(
+            "SELECT value, created_at, accessed_at FROM results WHERE key = ?", (digest,)
+        ).fetchone()
+        if row is not None and self.ttl is not None and row[1] + self.ttl <= now:
+            with conn:
+                conn.execute("DELETE FROM results WHERE key = ?", (digest,))
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        if row[2] + self.ACCESS_RESOLUTION < now:
+            with conn:
+                conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, digest))
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put_result(self, key: tuple, paraphrases: List[str]) -> None:
+        """Store `paraphrases` under `key`, evicting old rows if over budget."""
+        value = json.dumps(list(paraphrases))
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            # An upsert rather than INSERT OR REPLACE: the implicit delete of a
+            # replace doesn't fire the usage trigger
+            conn.execute(
+                "INSERT INTO results (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                "value = excluded.value, size = excluded.size, "
+                "created_at = excluded.created_at, accessed_at = excluded.accessed_at",
+                (self._hash_key(key), value, size, now, now),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Delete least recently used rows until the total size fits the budget."""
+        total = conn.execute("SELECT bytes FROM results_usage WHERE id = 0").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY accessed_at"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM results WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def clear(self) -> None:
+        """Delete every stored result."""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM results")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss counters (hits/misses are per process)."""
+        conn = self._connection()
+        entries = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        total = conn.execute("SELECT bytes FROM results_usage WHERE id = 0").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
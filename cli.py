@@ -5,8 +5,13 @@ Usage: python cli.py "Your text here" [--num 5] [--style creative]
 """
 
 import argparse
+import os
 import sys
-from paraphraser import AIParaphraser
+from cache import DEFAULT_DISK_CACHE_PATH, DiskResultCache
+from paraphraser import (
+    AIParaphraser, BACKENDS, DECODING_STRATEGIES, PARAPHRASE_STYLES, QUANTIZATION_MODES
+)
+from tracing import ChromeTraceRecorder
 
 
 def main():
@@ -20,6 +25,9 @@ Examples:
   python cli.py "Machine learning rocks" --style creative
   python cli.py "AI is amazing" --num 5 --temperature 2.0
   python cli.py "Your text" --output paraphrases.txt
+  python cli.py "Your text" --seed 42 --cache
+  python cli.py "Your text" --quantize int8-dynamic
+  python cli.py "Your text" --backend onnx
 
 Styles:
   conservative  - Subtle changes, close to original
@@ -44,7 +52,7 @@ Styles:
     
     parser.add_argument(
         '-s', '--style',
-        choices=['conservative', 'balanced', 'creative', 'diverse'],
+        choices=list(PARAPHRASE_STYLES),
         default='balanced',
         help='Paraphrasing style (default: balanced)'
     )
@@ -58,7 +66,14 @@ Styles:
     parser.add_argument(
         '-d', '--diversity',
         type=float,
-        help='Diversity penalty (0.5-2.0, overrides style)'
+        help='Diversity penalty (0.5-2.0, 0 for plain beam search; overrides style)'
+    )
+    
+    parser.add_argument(
+        '--strategy',
+        choices=list(DECODING_STRATEGIES),
+        help='Decoding strategy (overrides style): sample (cheapest), '
+             'diverse_beam, beam_sample (most expensive)'
     )
     
     parser.add_argument(
@@ -68,6 +83,50 @@ Styles:
         help='Model to use (default: t5-base)'
     )
     
+    parser.add_argument(
+        '-q', '--quantize',
+        choices=list(QUANTIZATION_MODES),
+        default=os.environ.get('PARAPHRASER_QUANTIZE'),
+        help='Quantize the model for faster CPU inference (env: PARAPHRASER_QUANTIZE)'
+    )
+    
+    parser.add_argument(
+        '--backend',
+        choices=list(BACKENDS),
+        default=os.environ.get('PARAPHRASER_BACKEND', 'torch'),
+        help='Inference backend; onnx exports the model once and runs it with '
+             'ONNX Runtime on the CPU (env: PARAPHRASER_BACKEND)'
+    )
+    
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='Load the model from the local Hugging Face cache only, without hub lookups'
+    )
+    
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='Random seed for reproducible output'
+    )
+    
+    parser.add_argument(
+        '--cache',
+        nargs='?',
+        const=DEFAULT_DISK_CACHE_PATH,
+        default=os.environ.get('PARAPHRASER_CACHE'),
+        metavar='PATH',
+        help='Reuse seeded results from a persistent cache file shared with other runs '
+             f'(default path: {DEFAULT_DISK_CACHE_PATH}; env: PARAPHRASER_CACHE)'
+    )
+    
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        help='Write a Chrome trace (chrome://tracing, ui.perfetto.dev) of the generation '
+             'stages to FILE'
+    )
+    
     parser.add_argument(
         '-o', '--output',
         help='Output file to save results'
@@ -110,29 +169,32 @@ Styles:
         print("Error: No text provided", file=sys.stderr)
         sys.exit(1)
     
-    # Style presets
-    style_params = {
-        'conservative': {'temperature': 0.7, 'diversity_penalty': 0.5},
-        'balanced': {'temperature': 1.2, 'diversity_penalty': 1.0},
-        'creative': {'temperature': 1.8, 'diversity_penalty': 1.5},
-        'diverse': {'temperature': 2.0, 'diversity_penalty': 2.0},
-    }
-    
-    # Get parameters
-    params = style_params[args.style].copy()
+    # Get parameters from the style preset (shared with the library)
+    params = PARAPHRASE_STYLES[args.style].copy()
     
     # Override with command-line args if provided
     if args.temperature is not None:
         params['temperature'] = args.temperature
     if args.diversity is not None:
         params['diversity_penalty'] = args.diversity
+    if args.strategy is not None:
+        params['strategy'] = args.strategy
     
     # Load model
     if not args.quiet:
         print(f"Loading {args.model} model...", file=sys.stderr)
     
     try:
-        paraphraser = AIParaphraser(model_name=args.model)
+        result_store = DiskResultCache(args.cache) if args.cache else None
+        paraphraser = AIParaphraser(
+            model_name=args.model,
+            result_store=result_store,
+            quantize=args.quantize,
+            backend=args.backend,
+            local_files_only=args.offline,
+            device='cpu' if args.quantize or args.backend == 'onnx' else None,
+            tracer=ChromeTraceRecorder() if args.trace else None,
+        )
     except Exception as e:
         print(f"Error loading model: {e}", file=sys.stderr)
         sys.exit(1)
@@ -145,12 +207,21 @@ Styles:
         paraphrases = paraphraser.paraphrase(
             text,
             num_paraphrases=args.num,
+            seed=args.seed,
             **params
         )
     except Exception as e:
         print(f"Error generating paraphrases: {e}", file=sys.stderr)
         sys.exit(1)
     
+    if args.trace:
+        try:
+            paraphraser.tracer.save(args.trace)
+            if not args.quiet:
+                print(f"Trace saved to {args.trace}", file=sys.stderr)
+        except Exception as e:
+            print(f"Error saving trace: {e}", file=sys.stderr)
+    
     # Format output
     output_lines = []
     
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+CPU thread and core-pinning configuration for inference workers
+
+Several workers on one machine should each get their own block of cores and
+a matching thread count, otherwise every worker starts one thread per core
+and they oversubscribe the machine. Thread counts and CPU affinity are
+process-wide settings, so they are applied once per worker process.
+
+Usage: python cpu_layout.py --instances 4 [--threads 2] [--cpus 0-7]
+"""
+
+import argparse
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on (respects taskset/cgroup affinity)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """Parse a CPU list such as '0-3,8,10-11'."""
+    cpus: List[int] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    if not cpus:
+        raise ValueError(f"Empty CPU list: '{spec}'")
+    return sorted(set(cpus))
+
+
+def format_cpu_list(cpus: Sequence[int]) -> str:
+    """Format CPUs as a compact list, e.g. [0, 1, 2, 3, 8] -> '0-3,8'."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def plan_layout(
+    num_instances: Optional[int] = None,
+    threads_per_instance: Optional[int] = None,
+    cpus: Optional[Sequence[int]] = None,
+) -> List[List[int]]:
+    """
+    Split CPUs into one contiguous block per instance ("N instances x M threads").
+
+    Give either count and the other is derived from the number of CPUs;
+    give neither for a single instance using every CPU.
+
+    Args:
+        num_instances: Number of worker processes
+        threads_per_instance: Threads (and cores) per worker
+        cpus: CPUs to distribute (default: every CPU available to this process)
+
+    Returns:
+        One list of CPU ids per instance
+    """
+    cpus = list(cpus) if cpus is not None else available_cpus()
+    if num_instances is None and threads_per_instance is None:
+        num_instances = 1
+    if num_instances is None:
+        num_instances = max(len(cpus) // threads_per_instance, 1)
+    if threads_per_instance is None:
+        threads_per_instance = max(len(cpus) // num_instances, 1)
+
+    if num_instances < 1 or threads_per_instance < 1:
+        raise ValueError("Instances and threads per instance must be at least 1")
+    if num_instances * threads_per_instance > len(cpus):
+        raise ValueError(
+            f"{num_instances} instances x {threads_per_instance} threads needs "
+            f"{num_instances * threads_per_instance} CPUs, only {len(cpus)} available"
+        )
+
+    return [
+        cpus[i * threads_per_instance:(i + 1) * threads_per_instance]
+        for i in range(num_instances)
+    ]
+
+
+def configure_threads(
+    num_threads: Optional[int] = None,
+    interop_threads: Optional[int] = None,
+    cpus: Optional[Sequence[int]] = None,
+) -> Dict[str, Any]:
+    """
+    Pin this process to `cpus` and set torch's thread pools.
+
+    When only `cpus` is given the intra-op thread count defaults to the
+    number of pinned CPUs. Settings left as None are not changed.
+
+    Returns:
+        The effective settings: num_threads, interop_threads and cpus
+    """
+    import torch
+
+    if cpus is not None:
+        cpus = sorted(set(cpus))
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+        else:
+            print("CPU affinity is not supported on this platform, ignoring it")
+        if num_threads is None:
+            num_threads = len(cpus)
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            # Only allowed once, before any inter-op parallel work has started
+            print(f"Could not set inter-op threads ({e})")
+
+    return {
+        "num_threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "cpus": available_cpus(),
+    }
+
+
+def settings_from_env(environ=None) -> Dict[str, Any]:
+    """
+    Read thread settings for a server worker from the environment.
+
+    PARAPHRASER_THREADS           intra-op threads
+    PARAPHRASER_INTEROP_THREADS   inter-op threads
+    PARAPHRASER_CPUS              CPUs to pin to, e.g. '0-3'
+    PARAPHRASER_INSTANCES         with PARAPHRASER_INSTANCE, pin to this
+                                  instance's block of an N-instance layout
+
+    Returns:
+        Keyword arguments for AIParaphraser (num_threads, interop_threads,
+        cpu_affinity); empty when nothing is configured
+    """
+    environ = os.environ if environ is None else environ
+    settings: Dict[str, Any] = {}
+
+    if environ.get("PARAPHRASER_THREADS"):
+        settings["num_threads"] = int(environ["PARAPHRASER_THREADS"])
+    if environ.get("PARAPHRASER_INTEROP_THREADS"):
+        settings["interop_threads"] = int(environ["PARAPHRASER_INTEROP_THREADS"])
+
+    cpus = parse_cpu_list(environ["PARAPHRASER_CPUS"]) if environ.get("PARAPHRASER_CPUS") else None
+    if environ.get("PARAPHRASER_INSTANCES"):
+        layout = plan_layout(
+            int(environ["PARAPHRASER_INSTANCES"]), settings.get("num_threads"), cpus
+        )
+        index = int(environ.get("PARAPHRASER_INSTANCE", 0))
+        if not 0 <= index < len(layout):
+            raise ValueError(f"PARAPHRASER_INSTANCE must be between 0 and {len(layout) - 1}")
+        cpus = layout[index]
+    if cpus is not None:
+        settings["cpu_affinity"] = cpus
+
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Plan an "N instances x M threads" worker layout',
+    )
+    parser.add_argument('-n', '--instances', type=int, help='Number of worker processes')
+    parser.add_argument('-t', '--threads', type=int, help='Threads per worker')
+    parser.add_argument('--cpus', help='CPUs to use, e.g. 0-7 (default: all available)')
+    args = parser.parse_args()
+
+    cpus = parse_cpu_list(args.cpus) if args.cpus else None
+    try:
+        layout = plan_layout(args.instances, args.threads, cpus)
+    except ValueError as e:
+        parser.error(str(e))
+
+    for index, block in enumerate(layout):
+        print(
+            f"PARAPHRASER_CPUS={format_cpu_list(block)} "
+            f"PARAPHRASER_THREADS={len(block)} PARAPHRASER_INTEROP_THREADS=1"
+            f"  # instance {index}"
+        )
+
+
+if __name__ == "__main__":
+    main()
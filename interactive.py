@@ -2,7 +2,8 @@
 Interactive Paraphraser - Chat-style interface for paraphrasing
 """
 
-from paraphraser import AIParaphraser
+from paraphraser import AIParaphraser, PARAPHRASE_STYLES
+import os
 import sys
 
 
@@ -36,19 +37,19 @@ def show_styles(paraphraser, text):
     print("-" * 80)
     
     styles_config = {
-        "Conservative": {"temperature": 0.7, "diversity_penalty": 0.5},
-        "Balanced": {"temperature": 1.2, "diversity_penalty": 1.0},
-        "Creative": {"temperature": 1.8, "diversity_penalty": 1.5},
-        "Diverse": {"temperature": 2.0, "diversity_penalty": 2.0},
+        name.capitalize(): params for name, params in PARAPHRASE_STYLES.items()
     }
     
-    for style_name, params in styles_config.items():
+    # All styles share one batched generation pass
+    results = paraphraser.paraphrase_with_styles(
+        text,
+        num_per_style=2,
+        max_length=512,
+        styles=styles_config,
+    )
+    
+    for style_name, paraphrases in results.items():
         print(f"\n{style_name} Style:")
-        paraphrases = paraphraser.paraphrase(
-            text,
-            num_paraphrases=2,
-            **params
-        )
         for i, para in enumerate(paraphrases, 1):
             print(f"  {i}. {para}")
     
@@ -61,13 +62,16 @@ def main():
     
     # Initialize paraphraser
     print("Loading AI model (this may take a moment)...\n")
+    # PARAPHRASER_QUANTIZE=int8-dynamic runs a quantized model on the CPU
+    quantize = os.environ.get('PARAPHRASER_QUANTIZE') or None
+    model_options = {'quantize': quantize, 'device': 'cpu'} if quantize else {}
     try:
-        paraphraser = AIParaphraser(model_name="t5-base")
+        paraphraser = AIParaphraser(model_name="t5-base", **model_options)
     except Exception as e:
         print(f"Error loading model: {e}")
         print("\nTrying smaller model (t5-small)...")
         try:
-            paraphraser = AIParaphraser(model_name="t5-small")
+            paraphraser = AIParaphraser(model_name="t5-small", **model_options)
         except Exception as e:
             print(f"Error: {e}")
             print("\nPlease ensure you have installed the requirements:")
@@ -0,0 +1,412 @@
+"""
+Background jobs for long documents: submit, poll for progress, fetch the result
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from scheduler import Overloaded, QueueFull
+
+
+DEFAULT_JOBS_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "paraphraser", "jobs.sqlite3"
+)
+
+JOB_STATES = ("queued", "running", "done", "failed")
+
+
+class JobStore:
+    """
+    Persistent job table stored in a SQLite database.
+
+    Jobs are claimed atomically, so several threads and processes (pre-fork
+    workers) can run jobs from the same file. Each running job records the
+    runner that claimed it and a lease (`heartbeat_at`) the runner renews
+    while it is alive; jobs whose lease has expired are put back in the
+    queue by `requeue_orphans`, so a crash or restart loses no work, even
+    when the new process reuses the dead one's host name and pid.
+    """
+
+    def __init__(self, path: str = DEFAULT_JOBS_PATH, timeout: float = 5.0):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+            timeout: Seconds to wait for a lock held by another process
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, text TEXT NOT NULL, "
+            "options TEXT NOT NULL, done INTEGER NOT NULL DEFAULT 0, total INTEGER, "
+            "result TEXT, error TEXT, worker TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+        )
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "heartbeat_at" not in columns:
+            # Files created before leases existed
+            conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, reopening it after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def submit(self, text: str, options: Dict[str, Any]) -> str:
+        """Queue a job and return its id."""
+        job_id = uuid.uuid4().hex
+        self._connection().execute(
+            "INSERT INTO jobs (id, status, text, options, created_at) "
+            "VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, text, json.dumps(options), time.time()),
+        )
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Mark the oldest queued job as running by `worker` and return it, or None."""
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front, so two workers can't claim the same job
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, "
+                    "heartbeat_at = ?, done = 0 WHERE id = ?",
+                    (worker, now, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row["id"], with_text=True) if row is not None else None
+
+    def progress(self, job_id: str, done: int, total: Optional[int]) -> None:
+        """Record how many of the job's sentences are finished."""
+        self._connection().execute(
+            "UPDATE jobs SET done = ?, total = ? WHERE id = ?", (done, total, job_id)
+        )
+
+    def finish(self, job_id: str, result: List[str]) -> None:
+        """Store a job's result and mark it done."""
+        self._connection().execute(
+            "UPDATE jobs SET status = 'done', result = ?, done = COALESCE(total, 1), "
+            "total = COALESCE(total, 1), finished_at = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, error: str) -> None:
+        """Mark a job as failed with `error`."""
+        self._connection().execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            (error, time.time(), job_id),
+        )
+
+    def requeue(self, job_id: str) -> None:
+        """Put a claimed job back in the queue (keeping its place)."""
+        self._connection().execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL, "
+            "heartbeat_at = NULL, done = 0 WHERE id = ?",
+            (job_id,),
+        )
+
+    def heartbeat(self, worker: str) -> None:
+        """Renew the lease on every job `worker` is running."""
+        self._connection().execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND worker = ?",
+            (time.time(), worker),
+        )
+
+    def get(self, job_id: str, with_text: bool = False) -> Optional[Dict[str, Any]]:
+        """Return a job as a dict (result decoded), or None if it doesn't exist."""
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        if not with_text:
+            del job["text"]
+        return job
+
+    def position(self, job_id: str) -> Optional[int]:
+        """Number of queued jobs ahead of `job_id`."""
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < "
+            "(SELECT created_at FROM jobs WHERE id = ?)",
+            (job_id,),
+        ).fetchone()
+        return row[0]
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs in each state."""
+        counts = dict.fromkeys(JOB_STATES, 0)
+        for status, count in self._connection().execute(
+            "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+        ):
+            counts[status] = count
+        return counts
+
+    def requeue_orphans(self, lease: float) -> int:
+        """Requeue running jobs whose lease wasn't renewed in the last `lease` seconds."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL, "
+            "heartbeat_at = NULL, done = 0 "
+            "WHERE status = 'running' AND COALESCE(heartbeat_at, started_at, 0) < ?",
+            (time.time() - lease,),
+        )
+        return cursor.rowcount
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished and failed jobs that ended more than `older_than` seconds ago."""
+        cursor = self._connection().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (time.time() - older_than,),
+        )
+        return cursor.rowcount
+
+
+class JobRunner:
+    """
+    Worker threads that run queued jobs through a BatchScheduler.
+
+    A job's sentences are streamed through the scheduler a batch at a time,
+    sharing the model thread with interactive requests, and each finished
+    sentence updates the job's progress. HTTP handlers only submit and read
+    jobs, so they never wait on the model.
+
+    Every `start` picks a new random runner id. A heartbeat thread renews
+    the lease on the runner's jobs every `lease / 3` seconds and requeues
+    jobs of any runner whose lease has lapsed for `lease` seconds.
+    """
+
+    # Seconds between checks for jobs queued by other processes
+    POLL_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        store: JobStore,
+        scheduler,
+        workers: int = 1,
+        max_queued: Optional[int] = None,
+        retention: float = 7 * 24 * 3600,
+        lease: float = 60.0,
+    ):
+        """
+        Args:
+            store: Where jobs are kept
+            scheduler: The BatchScheduler jobs run on
+            workers: Number of worker threads
+            max_queued: Maximum number of queued jobs (None: unbounded)
+            retention: Seconds finished jobs are kept before being purged
+            lease: Seconds a running job may go without a heartbeat before
+                   it is considered abandoned and queued again
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if lease <= 0:
+            raise ValueError("lease must be positive")
+        self.store = store
+        self.scheduler = scheduler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self.lease = lease
+        self.runner_id = None
+
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._pid = None
+        self._lock = threading.Lock()
+        # (store update, job id, arguments) outcomes the store refused so far
+        self._unsettled: List[tuple] = []
+
+    def start(self) -> None:
+        """Requeue orphaned jobs and start the worker threads (again after a fork)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Host and pid are only for people reading the table; the random
+            # part keeps a restarted process that reuses a pid from passing
+            # for the runner it replaced
+            self.runner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            self._requeue_orphans()
+            self.store.purge(self.retention)
+            self._threads = [
+                threading.Thread(target=self._run, name=f"paraphrase-jobs-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            self._threads.append(
+                threading.Thread(target=self._heartbeat, name="paraphrase-jobs-lease", daemon=True)
+            )
+            for thread in self._threads:
+                thread.start()
+
+    def submit(
+        self, text: str, num_paraphrases: int = 5, seed: Optional[int] = None, **params
+    ) -> str:
+        """Queue a document and return the job id (raises QueueFull when the queue is full)."""
+        self.start()
+        if self.max_queued is not None:
+            queued = self.store.counts()["queued"]
+            if queued >= self.max_queued:
+                raise QueueFull(f"Too many queued jobs ({queued})", retry_after=60)
+        job_id = self.store.submit(text, dict(num_paraphrases=num_paraphrases, seed=seed, **params))
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the job, with its queue position while it is waiting."""
+        job = self.store.get(job_id)
+        if job is not None and job["status"] == "queued":
+            job["position"] = self.store.position(job_id)
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the worker settings and the number of jobs in each state."""
+        return {"workers": self.workers, "max_queued": self.max_queued, **self.store.counts()}
+
+    def _run(self) -> None:
+        while True:
+            self._settle_pending()
+            try:
+                job = self.store.claim(self.runner_id)
+            except sqlite3.Error as e:
+                # Another process held the lock for too long; try again later
+                print(f"Could not claim a job ({e})")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._execute(job)
+
+    def _heartbeat(self) -> None:
+        """Renew this runner's leases and requeue the jobs of runners that stopped."""
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                self.store.heartbeat(self.runner_id)
+            except sqlite3.Error as e:
+                # Renewed on the next beat, well before the lease runs out
+                print(f"Could not renew job leases ({e})")
+            self._requeue_orphans()
+
+    def _requeue_orphans(self) -> None:
+        try:
+            requeued = self.store.requeue_orphans(self.lease)
+        except sqlite3.Error as e:
+            print(f"Could not requeue interrupted jobs ({e})")
+            return
+        if requeued:
+            print(f"Requeued {requeued} interrupted jobs")
+            self._wakeup.set()
+
+    def _execute(self, job: Dict[str, Any]) -> None:
+        """Run a claimed job and record its outcome; never raises."""
+        try:
+            paraphrases = self._paraphrase(job)
+        except Exception as e:
+            self._settle(self.store.fail, job["id"], str(e))
+        else:
+            self._settle(self.store.finish, job["id"], paraphrases)
+
+    def _paraphrase(self, job: Dict[str, Any]) -> List[str]:
+        """
+        Paraphrase a job's document through the scheduler.
+
+        The sentences go in as several scheduler requests of `max_batch`
+        sentences each (one per sentence for seeded jobs, see
+        `BatchScheduler.stream_many`), so interactive requests run between
+        them, and progress moves as each one finishes. The job fails if any
+        sentence does.
+        """
+        options = dict(job["options"])
+        num_paraphrases = options.pop("num_paraphrases")
+        seed = options.pop("seed")
+        paraphraser = self.scheduler.paraphraser
+        sentences = paraphraser.split_sentences(job["text"])
+
+        if len(sentences) <= 1:
+            events = self._wait_turn(lambda: self.scheduler.stream(
+                job["text"], num_paraphrases, seed, paragraph=True, **options
+            ))
+            return [event["text"] for event in events if event["type"] == "paraphrase"]
+
+        events = self._wait_turn(lambda: self.scheduler.stream_many(
+            sentences, paraphraser.variations_per_sentence(num_paraphrases), seed, **options
+        ))
+        variations: List[List[str]] = [[] for _ in sentences]
+        done = 0
+        try:
+            for event in events:
+                if "error" in event:
+                    raise RuntimeError(event["error"])
+                # Keep the original sentence if it got no variations
+                variations[event["index"]] = event["paraphrases"] or [sentences[event["index"]]]
+                done += 1
+                self._progress(job["id"], done, len(sentences))
+        finally:
+            # Stops the remaining sentences when one has failed
+            events.close()
+        return paraphraser.combine_sentences(variations, num_paraphrases, seed)
+
+    @staticmethod
+    def _wait_turn(submit):
+        """Call `submit` until the scheduler takes the request."""
+        while True:
+            try:
+                return submit()
+            except Overloaded as e:
+                # Interactive traffic has the scheduler busy; wait our turn
+                time.sleep(e.retry_after)
+
+    def _progress(self, job_id: str, done: int, total: int) -> None:
+        try:
+            self.store.progress(job_id, done, total)
+        except sqlite3.Error as e:
+            # Progress is informational; the next update or the result catches up
+            print(f"Could not record progress of job {job_id} ({e})")
+
+    def _settle(self, update, job_id: str, *args) -> None:
+        """Record a job's outcome with `update`, retrying later if the store fails."""
+        try:
+            update(job_id, *args)
+        except Exception as e:
+            # Left as is the job would stay 'running' for as long as this
+            # process lives, so keep the outcome and try again
+            print(f"Could not record the outcome of job {job_id} ({e}), will retry")
+            with self._lock:
+                self._unsettled.append((update, job_id, args))
+
+    def _settle_pending(self) -> None:
+        """Retry recording outcomes that failed earlier."""
+        with self._lock:
+            pending, self._unsettled = self._unsettled, []
+        for update, job_id, args in pending:
+            self._settle(update, job_id, *args)
@@ -0,0 +1,322 @@
+"""
+Minimal Prometheus-format metrics (counters, gauges, histograms) for the servers
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+
+# Seconds; spans sub-millisecond tokenization up to long paragraph generations
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+# Stages of a request timed by AIParaphraser
+STAGES = ("tokenize", "encode", "generate", "decode", "dedup", "assemble")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self, constant_labels: Optional[Dict[str, object]] = None) -> List[str]:
+        """Sample lines, with `constant_labels` added to every series."""
+        constant_labels = constant_labels or {}
+        names = self.labelnames + tuple(constant_labels)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items(), key=lambda item: str(item[0])):
+                lines.extend(self._samples(names, key + tuple(constant_labels.values()), value))
+        return lines
+
+    def _samples(self, names: Sequence[str], key: tuple, value) -> List[str]:
+        return [f"{self.name}{_format_labels(names, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def sync(self, total: float, **labels) -> None:
+        """Mirror a count that is kept (and only ever increased) elsewhere."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = total
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, names: Sequence[str], key: tuple, value) -> List[str]:
+        counts, total = value
+        lines = []
+        for bound, count in zip(self.buckets, counts):
+            le = 'le="%s"' % _format_value(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(names, key, le)} {count}")
+        labels = _format_labels(names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Named metrics rendered together in the Prometheus text format.
+
+    Registering a name that already exists returns the existing metric, so
+    modules can declare the metrics they use without coordinating.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(
+        self, cls, name: str, help: str, labelnames: Sequence[str], **kwargs
+    ) -> _Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(
+                    f"Metric {name} is already registered with another type or labels"
+                )
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self, **constant_labels) -> str:
+        """
+        All metrics in the Prometheus text exposition format (version 0.0.4).
+
+        `constant_labels` are added to every series, e.g. the process that
+        answered the scrape, so series from different workers stay apart.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render(constant_labels))
+        return "\n".join(lines) + "\n"
+
+
+class EngineMetrics:
+    """
+    The metrics AIParaphraser records while generating.
+
+    Every series is labeled by model and mode (the public method that was
+    called: paraphrase, paragraph, many, styles or batch).
+    """
+
+    def __init__(self, registry: "MetricsRegistry"):
+        labels = ("model", "mode")
+        self.calls = registry.counter(
+            "paraphraser_engine_calls_total", "Calls to the paraphrasing engine", labels
+        )
+        self.stage_seconds = registry.histogram(
+            "paraphraser_stage_seconds",
+            "Time spent in each stage: " + ", ".join(STAGES),
+            labels + ("stage",),
+        )
+        self.generated_tokens = registry.counter(
+            "paraphraser_generated_tokens_total", "Tokens produced by generate", labels
+        )
+        self.tokens_per_second = registry.gauge(
+            "paraphraser_tokens_per_second",
+            "Generated tokens per second in the latest generate call",
+            labels,
+        )
+        self.candidates = registry.counter(
+            "paraphraser_candidates_total", "Candidates generated before filtering", labels
+        )
+        self.returned = registry.counter(
+            "paraphraser_paraphrases_total", "Paraphrases returned after filtering", labels
+        )
+
+    def observe_stage(self, model: str, mode: str, stage: str, seconds: float) -> None:
+        self.stage_seconds.observe(seconds, model=model, mode=mode, stage=stage)
+
+    def observe_generate(self, model: str, mode: str, tokens: int, seconds: float) -> None:
+        self.generated_tokens.inc(tokens, model=model, mode=mode)
+        if seconds > 0:
+            self.tokens_per_second.set(tokens / seconds, model=model, mode=mode)
+
+
+class ServerMetrics:
+    """
+    Metrics of a web server process: HTTP traffic, plus the scheduler queue,
+    cache and job figures copied from their stats at scrape time.
+    """
+
+    def __init__(self, registry: "MetricsRegistry"):
+        self.http_requests = registry.counter(
+            "paraphraser_http_requests_total", "HTTP requests", ("endpoint", "method", "status")
+        )
+        self.http_seconds = registry.histogram(
+            "paraphraser_http_request_seconds",
+            "Time until the response started (streamed bodies continue after it)",
+            ("endpoint",),
+        )
+        self.queue_depth = registry.gauge(
+            "paraphraser_queue_depth", "Requests waiting in the batch scheduler", ("model",)
+        )
+        self.oldest_wait = registry.gauge(
+            "paraphraser_queue_oldest_wait_seconds",
+            "Age of the oldest waiting request",
+            ("model",),
+        )
+        self.scheduled = registry.counter(
+            "paraphraser_scheduled_requests_total",
+            "Requests submitted to the batch scheduler",
+            ("model",),
+        )
+        self.batches = registry.counter(
+            "paraphraser_batches_total", "Batches run by the batch scheduler", ("model",)
+        )
+        self.batch_size = registry.gauge(
+            "paraphraser_batch_size_mean", "Mean number of requests per batch", ("model",)
+        )
+        self.shed = registry.counter(
+            "paraphraser_requests_shed_total",
+            "Requests turned away with a 503",
+            ("model", "reason"),
+        )
+        self.cache_hits = registry.counter(
+            "paraphraser_cache_hits_total", "Cache hits", ("model", "cache")
+        )
+        self.cache_misses = registry.counter(
+            "paraphraser_cache_misses_total", "Cache misses", ("model", "cache")
+        )
+        self.cache_hit_ratio = registry.gauge(
+            "paraphraser_cache_hit_ratio", "Cache hits / lookups", ("model", "cache")
+        )
+        self.jobs = registry.gauge(
+            "paraphraser_jobs", "Background jobs by state (shared job store)", ("state",)
+        )
+
+    def observe_request(self, endpoint: str, method: str, status: int, seconds: float) -> None:
+        self.http_requests.inc(endpoint=endpoint, method=method, status=str(status))
+        self.http_seconds.observe(seconds, endpoint=endpoint)
+
+    def collect(self, paraphraser, scheduler=None, jobs=None) -> None:
+        """Copy the current queue, cache and job figures into the metrics."""
+        model = paraphraser.model_name
+        if scheduler is not None:
+            stats = scheduler.stats()
+            self.queue_depth.set(stats["queue_depth"], model=model)
+            self.oldest_wait.set(stats["oldest_wait_ms"] / 1000, model=model)
+            self.scheduled.sync(stats["requests"], model=model)
+            self.batches.sync(stats["batches"], model=model)
+            self.batch_size.set(stats["mean_batch_size"], model=model)
+            self.shed.sync(stats["rejected"], model=model, reason="queue_full")
+            self.shed.sync(stats["timed_out"], model=model, reason="queue_timeout")
+
+        caches = {"encoder": paraphraser.encoder_cache, "result": paraphraser.result_cache}
+        if paraphraser.result_store is not None:
+            caches["disk"] = paraphraser.result_store
+        for name, cache in caches.items():
+            stats = cache.stats()
+            self.cache_hits.sync(stats["hits"], model=model, cache=name)
+            self.cache_misses.sync(stats["misses"], model=model, cache=name)
+            self.cache_hit_ratio.set(stats["hit_ratio"], model=model, cache=name)
+
+        if jobs is not None:
+            for state, count in jobs.store.counts().items():
+                self.jobs.set(count, state=state)
+
+
+# Registry and metrics shared by everything in the process
+registry = MetricsRegistry()
+engine_metrics = EngineMetrics(registry)
+server_metrics = ServerMetrics(registry)
@@ -0,0 +1,117 @@
+"""
+Process-wide registry of loaded models, so paraphrasers share weights
+"""
+
+import gc
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ModelRegistry:
+    """
+    Cache of loaded model/tokenizer pairs shared by AIParaphraser instances.
+
+    Entries are keyed by everything that changes the loaded weights (model
+    name, revision, device, precision, backend, ...). Every instance using an
+    entry is tracked with a weak reference, so the reference count drops by
+    itself when an instance is garbage collected or closed. Unloading removes
+    an entry from the registry; its memory is freed once the last instance
+    holding it goes away.
+    """
+
+    def __init__(self):
+        self._entries: Dict[tuple, Dict[str, Any]] = {}
+        self._owners: Dict[tuple, "weakref.WeakSet"] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(**fields) -> tuple:
+        """Build a registry key from the fields that identify a loaded model."""
+        return tuple(sorted(fields.items()))
+
+    def acquire(
+        self, key: tuple, load: Callable[[], Dict[str, Any]], owner: Optional[object] = None
+    ) -> Dict[str, Any]:
+        """
+        Return the entry for `key`, calling `load()` to create it on first use.
+
+        Args:
+            key: Key from `make_key`
+            load: Loads the model; returns a dict with at least 'model',
+                  'tokenizer' and 'model_size_mb'
+            owner: Object holding a reference to the entry (counted until it
+                   is released or garbage collected)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # Loading under the lock keeps concurrent callers from loading
+                # the same weights twice
+                entry = load()
+                self._entries[key] = entry
+                self._owners[key] = weakref.WeakSet()
+            if owner is not None:
+                self._owners[key].add(owner)
+            return entry
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def release(self, key: tuple, owner: object) -> None:
+        """Stop counting `owner` as a user of `key` (the entry stays loaded)."""
+        with self._lock:
+            owners = self._owners.get(key)
+            if owners is not None:
+                owners.discard(owner)
+
+    def unload(self, model_name: Optional[str] = None, unused_only: bool = False) -> int:
+        """
+        Remove entries from the registry.
+
+        Args:
+            model_name: Only unload entries for this model (default: all)
+            unused_only: Keep entries that are still used by an instance
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            doomed = [
+                key for key in self._entries
+                if (model_name is None or dict(key).get("model_name") == model_name)
+                and not (unused_only and len(self._owners[key]))
+            ]
+            for key in doomed:
+                del self._entries[key]
+                del self._owners[key]
+        if doomed:
+            gc.collect()
+        return len(doomed)
+
+    def resident(self) -> List[Dict[str, Any]]:
+        """Describe the loaded models: key fields, number of users and size."""
+        with self._lock:
+            return [
+                {
+                    **dict(key),
+                    "refs": len(self._owners[key]),
+                    "size_mb": round(entry["model_size_mb"], 1),
+                }
+                for key, entry in self._entries.items()
+            ]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the resident models and their total size."""
+        models = self.resident()
+        return {
+            "models": models,
+            "total_mb": round(sum(model["size_mb"] for model in models), 1),
+        }
+
+
+# Registry shared by every AIParaphraser in the process
+model_registry = ModelRegistry()
@@ -0,0 +1,205 @@
+"""
+ONNX Runtime backend for the paraphraser
+
+Exports a seq2seq model to ONNX once (encoder, decoder and decoder-with-past,
+so generation reuses the key/value cache instead of re-running the decoder
+over the whole prefix every step), stores the exported files on disk and runs
+them with ONNX Runtime on the CPU.
+
+Requires the optional `optimum[onnxruntime]` package.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Optional
+
+
+DEFAULT_ONNX_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "paraphraser", "onnx"
+)
+
+WEIGHT_FILES = ("model.safetensors", "pytorch_model.bin", "config.json")
+
+
+def _require_optimum():
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise ImportError(
+            "The ONNX backend needs optimum with ONNX Runtime: "
+            "pip install 'optimum[onnxruntime]'"
+        ) from e
+    return ORTModelForSeq2SeqLM
+
+
+def _local_fingerprint(path: str) -> str:
+    """Fingerprint a local model directory from the size and mtime of its weights."""
+    digest = hashlib.sha256()
+    for name in WEIGHT_FILES:
+        file_path = os.path.join(path, name)
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def resolve_revision(
+    model_name: str, revision: str = "main", local_files_only: bool = False
+) -> str:
+    """
+    Resolve a hub branch or tag to the commit hash it currently points at.
+
+    Uses the hub's local cache (and only that with `local_files_only`), so
+    offline runs resolve to the commit that was downloaded last.
+    """
+    if re.fullmatch(r"[0-9a-f]{40}", revision):
+        return revision
+    from huggingface_hub import hf_hub_download
+
+    # Cached files live under snapshots/<commit hash>/
+    config_path = hf_hub_download(
+        model_name, "config.json", revision=revision, local_files_only=local_files_only
+    )
+    return os.path.basename(os.path.dirname(config_path))
+
+
+def model_revision(
+    model_name: str, revision: str = "main", local_files_only: bool = False
+) -> str:
+    """
+    Identify the weights that `model_name` at `revision` loads.
+
+    Hub models resolve to the commit hash the revision points at; local
+    model directories to a fingerprint of their weight files.
+    """
+    if os.path.isdir(model_name):
+        return _local_fingerprint(os.path.abspath(model_name))
+    return resolve_revision(model_name, revision, local_files_only)
+
+
+def export_dir(
+    model_name: str,
+    revision: str = "main",
+    cache_dir: str = DEFAULT_ONNX_CACHE_DIR,
+    local_files_only: bool = False,
+) -> str:
+    """
+    Directory holding the exported ONNX files for a model and revision.
+
+    Hub models are keyed by name and the commit hash the revision resolves
+    to, so moving a branch triggers a fresh export; local model directories
+    are keyed by their path and a fingerprint of their weight files, so
+    editing the weights does too.
+    """
+    if os.path.isdir(model_name):
+        name = os.path.abspath(model_name).strip(os.sep).replace(os.sep, "--")
+    else:
+        name = model_name.replace("/", "--")
+    return os.path.join(cache_dir, name, model_revision(model_name, revision, local_files_only))
+
+
+@contextmanager
+def _legacy_exporter():
+    """
+    Use the TorchScript-based ONNX exporter while exporting.
+
+    Recent torch releases default `torch.onnx.export` to the dynamo exporter,
+    which optimum's seq2seq export does not support yet.
+    """
+    import inspect
+    import torch
+
+    original = torch.onnx.export
+    if "dynamo" not in inspect.signature(original).parameters:
+        yield
+        return
+
+    def export(*args, **kwargs):
+        kwargs.setdefault("dynamo", False)
+        return original(*args, **kwargs)
+
+    torch.onnx.export = export
+    try:
+        yield
+    finally:
+        torch.onnx.export = original
+
+
+def load_onnx_model(
+    model_name: str,
+    revision: str = "main",
+    cache_dir: Optional[str] = None,
+    num_threads: Optional[int] = None,
+    local_files_only: bool = False,
+):
+    """
+    Load an ONNX Runtime seq2seq model, exporting it on first use.
+
+    Args:
+        model_name: Hub model name or local model directory
+        revision: Hub revision (branch, tag or commit) to export
+        cache_dir: Where exported models are kept (default: ~/.cache/paraphraser/onnx)
+        num_threads: Optional intra-op thread count for the ONNX Runtime sessions
+        local_files_only: Never contact the hub when exporting
+
+    Returns:
+        Tuple of (model, directory of the exported files). The model supports
+        `get_encoder()` and `generate()` like the PyTorch model.
+    """
+    ORTModelForSeq2SeqLM = _require_optimum()
+    import onnxruntime
+
+    target = export_dir(
+        model_name, revision, cache_dir or DEFAULT_ONNX_CACHE_DIR, local_files_only
+    )
+    if not os.path.isdir(model_name):
+        # Export exactly the commit the directory is named after
+        revision = os.path.basename(target)
+
+    if not os.path.exists(os.path.join(target, "config.json")):
+        print(f"Exporting {model_name} to ONNX (one-time)...")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Export into a scratch directory and move it into place, so concurrent
+        # workers never load a half-written export
+        scratch = tempfile.mkdtemp(prefix=".export-", dir=os.path.dirname(target))
+        try:
+            with _legacy_exporter():
+                exported = ORTModelForSeq2SeqLM.from_pretrained(
+                    model_name, revision=revision, export=True, use_cache=True,
+                    local_files_only=local_files_only,
+                )
+            exported.save_pretrained(scratch)
+            try:
+                os.rename(scratch, target)
+            except OSError:
+                # Another process finished the same export first
+                if not os.path.exists(os.path.join(target, "config.json")):
+                    raise
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        print(f"Saved ONNX export to {target}")
+
+    session_options = onnxruntime.SessionOptions()
+    if num_threads is not None:
+        session_options.intra_op_num_threads = num_threads
+
+    model = ORTModelForSeq2SeqLM.from_pretrained(
+        target,
+        use_cache=True,
+        provider="CPUExecutionProvider",
+        session_options=session_options,
+    )
+    return model, target
+
+
+def export_size_mb(path: str) -> float:
+    """Total size of the exported ONNX files in megabytes."""
+    total = 0
+    for name in os.listdir(path):
+        if name.endswith((".onnx", ".onnx_data", ".onnx.data")):
+            total += os.path.getsize(os.path.join(path, name))
+    return total / (1024 * 1024)
@@ -2,13 +2,125 @@
 AI Paraphraser - Generate multiple diverse paraphrases of input text
 """
 
-import torch
-from transformers import T5ForConditionalGeneration, T5Tokenizer
-from typing import List, Dict, Optional
+# torch and transformers are imported where they are first needed, so
+# importing this module (e.g. for `cli.py --help`) stays fast
+from typing import Any, Iterator, List, Dict, Optional, Sequence, Tuple
+from contextlib import contextmanager
+import functools
+import inspect
+import io
+import math
+import os
+import random
 import re
+import threading
+import time
 import warnings
 warnings.filterwarnings('ignore')
 
+from cache import DiskResultCache, EncoderCache, ResultCache
+from cpu_layout import configure_threads
+from model_registry import model_registry
+from tracing import Span
+
+
+def _operation(mode: str):
+    """
+    Decorator labeling a public method's work with `mode` for metrics and tracing.
+    
+    Nested calls (e.g. `paraphrase` -> `paraphrase_many`) keep the label of
+    the outermost one, which is also the root span of the trace.
+    """
+    def decorate(method):
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self._labeled(mode):
+                    yield from method(self, *args, **kwargs)
+        else:
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self._labeled(mode):
+                    return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def __getattr__(name):
+    # RowSamplingLogitsProcessor moved to sampling.py; resolve it lazily so
+    # the old import path keeps working without importing torch up front
+    if name == "RowSamplingLogitsProcessor":
+        from sampling import RowSamplingLogitsProcessor
+        return RowSamplingLogitsProcessor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Decoding strategies accepted by AIParaphraser. `relative_cost` is the rough
+# decoder cost per returned candidate compared to plain sampling.
+DECODING_STRATEGIES = {
+    # Independent top-k/top-p samples: one decoder row per candidate and each
+    # row stops at its own end-of-sequence token. Cheapest.
+    "sample": {
+        "relative_cost": 1.0,
+        "sampled": True,
+    },
+    # Diverse (group) beam search: one beam per candidate, each group penalised
+    # by `diversity_penalty` for repeating tokens chosen by earlier groups
+    # (a penalty of 0 runs plain beam search). Deterministic, and groups are
+    # processed one after another every step.
+    "diverse_beam": {
+        "relative_cost": 1.5,
+        "sampled": False,
+    },
+    # Beam search with sampling (the original behaviour): at least `num_beams`
+    # rows plus beam bookkeeping, and it keeps decoding until no beam can
+    # improve. Most expensive.
+    "beam_sample": {
+        "relative_cost": 2.0,
+        "sampled": True,
+    },
+}
+
+# Quantization modes accepted by AIParaphraser(quantize=...). Dynamic int8
+# stores linear-layer weights as int8 and quantizes activations on the fly;
+# it only runs on CPU.
+QUANTIZATION_MODES = ("int8-dynamic",)
+
+# Inference backends: PyTorch (any device) or ONNX Runtime (CPU, see onnx_backend.py)
+BACKENDS = ("torch", "onnx")
+
+# Style presets shared by paraphrase_with_styles, cli.py and interactive.py.
+# Each maps to the cheapest strategy that keeps the style's diversity: at
+# temperature >= 1.2 plain sampling already yields plenty of distinct outputs,
+# while low-temperature sampling repeats itself, so the conservative style uses
+# diverse beams to get distinct but faithful paraphrases.
+PARAPHRASE_STYLES = {
+    "conservative": {
+        "strategy": "diverse_beam",
+        "temperature": 0.7,
+        "top_p": 0.9,
+        "diversity_penalty": 0.5,
+    },
+    "balanced": {
+        "strategy": "sample",
+        "temperature": 1.2,
+        "top_p": 0.95,
+        "diversity_penalty": 1.0,
+    },
+    "creative": {
+        "strategy": "sample",
+        "temperature": 1.8,
+        "top_p": 0.98,
+        "diversity_penalty": 1.5,
+    },
+    "diverse": {
+        "strategy": "sample",
+        "temperature": 2.0,
+        "top_p": 0.99,
+        "diversity_penalty": 2.0,
+    },
+}
+
 
 class AIParaphraser:
     """
@@ -16,7 +128,46 @@ class AIParaphraser:
     using transformer models and various decoding strategies.
     """
     
-    def __init__(self, model_name: str = "tuner007/pegasus_paraphrase", device: Optional[str] = None):
+    # Fraction of generated candidates that survive filtering, tracked per
+    # model across instances to size the first adaptive round of unseeded
+    # calls; seeded calls always plan with the default so their output
+    # doesn't depend on earlier traffic
+    DEFAULT_UNIQUENESS_RATE = 0.6
+    ROUND_MARGIN = 1.2
+    _uniqueness_rates: Dict[str, float] = {}
+    
+    # (input tokens, batch size) shapes run through the model before the
+    # instance reports ready, so lazy initialisation, allocator growth and
+    # kernel compilation happen at startup rather than on the first requests
+    WARMUP_SHAPES = ((8, 1), (32, 1), (32, 4), (128, 4))
+    
+    def __init__(
+        self,
+        model_name: str = "tuner007/pegasus_paraphrase",
+        device: Optional[str] = None,
+        encoder_cache_mb: float = 64.0,
+        result_cache: Optional[ResultCache] = None,
+        result_store: Optional[DiskResultCache] = None,
+        adaptive: bool = False,
+        decoding_strategy: str = "beam_sample",
+        length_ratio: float = 1.5,
+        length_slack: int = 16,
+        use_fast: bool = True,
+        quantize: Optional[str] = None,
+        backend: str = "torch",
+        revision: str = "main",
+        onnx_cache_dir: Optional[str] = None,
+        compile: bool = False,
+        warmup: Optional[bool] = None,
+        warmup_shapes: Optional[Sequence[Tuple[int, int]]] = None,
+        num_threads: Optional[int] = None,
+        interop_threads: Optional[int] = None,
+        cpu_affinity: Optional[Sequence[int]] = None,
+        share_model: bool = True,
+        local_files_only: bool = False,
+        metrics=None,
+        tracer=None,
+    ):
         """
         Initialize the paraphraser with a pre-trained model.
         
@@ -25,11 +176,104 @@ class AIParaphraser:
                        Default: tuner007/pegasus_paraphrase (fine-tuned specifically for paraphrasing)
                        Other options: ramsrigouthamg/t5_paraphraser, t5-base
             device: Device to run on ('cuda', 'mps', or 'cpu')
+            encoder_cache_mb: Memory budget for cached tokenized inputs and
+                              encoder states, reused when the same text is
+                              paraphrased again (0 disables the cache)
+            result_cache: Cache for results of seeded requests (defaults to an
+                          in-process ResultCache)
+            result_store: Optional persistent store consulted after the
+                          in-process cache misses, e.g. a DiskResultCache
+                          shared by CLI runs and server workers
+            adaptive: Over-generate in rounds sized from the model's observed
+                      uniqueness rate instead of always generating 3x the
+                      requested number of candidates
+            decoding_strategy: Default decoding strategy, one of
+                               DECODING_STRATEGIES ('sample', 'diverse_beam',
+                               'beam_sample')
+            length_ratio: Output token budget per input token; generation is
+                          capped at `input_tokens * length_ratio + length_slack`
+                          new tokens (and never more than `max_length`)
+            length_slack: Extra output tokens allowed on top of the ratio
+            use_fast: Use the Rust-backed fast tokenizer when it can be loaded,
+                      falling back to the SentencePiece one otherwise
+            quantize: Optional CPU quantization mode applied at load time:
+                      'int8-dynamic' quantizes the weights of every linear
+                      layer (encoder, decoder and LM head) to int8
+            backend: 'torch' runs the PyTorch model; 'onnx' exports the model
+                     to ONNX once (cached on disk) and generates with ONNX
+                     Runtime on the CPU
+            revision: Model revision (branch, tag or commit) to load; a
+                      branch or tag is pinned to the commit it points at
+                      when the model is loaded
+            onnx_cache_dir: Where ONNX exports are kept (default:
+                            ~/.cache/paraphraser/onnx)
+            compile: Compile the encoder and the decoder step with
+                     torch.compile, falling back to a TorchScript-traced
+                     encoder where compilation is unsupported
+            warmup: Run warmup generations before reporting ready
+                    (defaults to on when `compile` is set)
+            warmup_shapes: (input tokens, batch size) pairs to warm up with
+                           (default: WARMUP_SHAPES)
+            num_threads: Intra-op CPU threads (defaults to the number of CPUs
+                         in `cpu_affinity`, or torch's default of all cores)
+            interop_threads: Inter-op CPU threads
+            cpu_affinity: CPU ids to pin the process to; see cpu_layout.py
+                          for splitting a machine between several workers.
+                          Threads and affinity are process-wide settings.
+            share_model: Reuse the model and tokenizer already loaded by
+                         another instance with the same settings (see
+                         model_registry.py) instead of loading a new copy
+            local_files_only: Resolve the model, tokenizer and revision from
+                              the local Hugging Face cache only, with no hub
+                              lookups (the model must already be downloaded)
+            metrics: Optional metrics.EngineMetrics to record stage timings,
+                     generated tokens and candidate counts in
+            tracer: Optional tracing.Tracer that receives a timed span for
+                    every call and each stage inside it, e.g. a
+                    ChromeTraceRecorder
         """
         print(f"Loading model: {model_name}...")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}'. Choose from: {', '.join(BACKENDS)}")
+        if backend == "onnx" and quantize is not None:
+            raise ValueError("Quantization is only supported with the 'torch' backend")
+        if backend == "onnx" and device not in (None, "cpu"):
+            raise ValueError("The 'onnx' backend only runs on the CPU device")
+        if backend == "onnx" and compile:
+            raise ValueError("Compilation is only supported with the 'torch' backend")
+        
+        # Set once loading (and warmup, if any) has finished
+        self.ready = False
+        
+        if num_threads is not None or interop_threads is not None or cpu_affinity is not None:
+            self.threads = configure_threads(num_threads, interop_threads, cpu_affinity)
+            print(
+                f"CPU threads: {self.threads['num_threads']} intra-op, "
+                f"{self.threads['interop_threads']} inter-op on {len(self.threads['cpus'])} CPUs"
+            )
+        else:
+            self.threads = None
+        
+        self.model_name = model_name
+        self.quantize = quantize
+        self.backend = backend
+        self.encoder_cache = EncoderCache(max_mb=encoder_cache_mb)
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self.result_store = result_store
+        self.adaptive = adaptive
+        self.decoding_strategy = self._check_strategy(decoding_strategy)
+        self.length_ratio = length_ratio
+        self.length_slack = length_slack
+        self.metrics = metrics
+        self.tracer = tracer
+        # Per-thread stack of the public calls in progress (see _operation)
+        self._calls = threading.local()
         
         # Determine device
-        if device is None:
+        if backend == "onnx":
+            self.device = "cpu"
+        elif device is None:
+            import torch
             if torch.cuda.is_available():
                 self.device = "cuda"
             elif torch.backends.mps.is_available():
@@ -41,21 +285,267 @@ class AIParaphraser:
         
         print(f"Using device: {self.device}")
         
+        # Everything that changes the loaded weights; instances that agree on
+        # all of it share one model through the registry
+        self.registry_key = model_registry.make_key(
+            model_name=model_name,
+            revision=revision,
+            device=self.device,
+            precision=quantize or "fp32",
+            backend=backend,
+            compile=compile,
+            use_fast=use_fast,
+        )
+        
+        def load():
+            return self._load_model(
+                model_name, revision, use_fast, quantize, backend, onnx_cache_dir, compile,
+                local_files_only,
+            )
+        
+        if share_model:
+            if self.registry_key in model_registry:
+                print("Reusing the already loaded model")
+            entry = model_registry.acquire(self.registry_key, load, owner=self)
+        else:
+            entry = load()
+        self.tokenizer = entry["tokenizer"]
+        self.model = entry["model"]
+        self.encoder = entry["encoder"]
+        self.compile_mode = entry["compile_mode"]
+        self.model_size_mb = entry["model_size_mb"]
+        self.revision = entry["revision"]
+        # Identifies the loaded weights and tokenizer in cache keys: seeded
+        # output differs between revisions, precisions, backends, devices and
+        # tokenizers, and the persistent result store outlives all of them
+        tokenizer_kind = "fast" if getattr(self.tokenizer, "is_fast", False) else "slow"
+        self.model_id = (
+            f"{model_name}@{self.revision}:{quantize or 'fp32'}:{backend}:"
+            f"{self.device}:{tokenizer_kind}"
+        )
+        
+        print("Model loaded successfully!")
+        
+        if (warmup if warmup is not None else compile) and not entry.get("warmed"):
+            self.warmup(warmup_shapes)
+            # Warmup may have replaced a failing compiled encoder
+            entry.update(encoder=self.encoder, compile_mode=self.compile_mode, warmed=True)
+        self.ready = True
+    
+    def _load_model(
+        self,
+        model_name: str,
+        revision: str,
+        use_fast: bool,
+        quantize: Optional[str],
+        backend: str,
+        onnx_cache_dir: Optional[str],
+        compile: bool,
+        local_files_only: bool = False,
+    ) -> Dict:
+        """
+        Load the tokenizer and model (exporting, quantizing or compiling it).
+        
+        Returns:
+            Registry entry with the tokenizer, model, encoder, compile mode,
+            model size and the revision that was loaded (commit hash, or a
+            fingerprint of a local model directory)
+        """
+        from onnx_backend import model_revision
+        
+        # Pin a hub branch or tag to the commit it points at now, so the
+        # tokenizer, the weights and the cache keys all come from one commit
+        resolved = model_revision(model_name, revision, local_files_only)
+        if not os.path.isdir(model_name):
+            revision = resolved
+        hub_options = {"revision": revision, "local_files_only": local_files_only}
+        
         # Load model and tokenizer based on model type
         if "pegasus" in model_name.lower():
-            from transformers import PegasusForConditionalGeneration, PegasusTokenizer
-            self.tokenizer = PegasusTokenizer.from_pretrained(model_name)
-            self.model = PegasusForConditionalGeneration.from_pretrained(model_name)
+            from transformers import (
+                PegasusForConditionalGeneration, PegasusTokenizer, PegasusTokenizerFast
+            )
+            self.tokenizer = self._load_tokenizer(
+                model_name, PegasusTokenizer, PegasusTokenizerFast, use_fast, **hub_options
+            )
+            model_class = PegasusForConditionalGeneration
         else:
             # T5-based models
-            self.tokenizer = T5Tokenizer.from_pretrained(model_name, legacy=False)
-            self.model = T5ForConditionalGeneration.from_pretrained(model_name)
+            from transformers import T5ForConditionalGeneration, T5Tokenizer, T5TokenizerFast
+            self.tokenizer = self._load_tokenizer(
+                model_name, T5Tokenizer, T5TokenizerFast, use_fast, legacy=False, **hub_options
+            )
+            model_class = T5ForConditionalGeneration
+        
+        if backend == "onnx":
+            from onnx_backend import export_size_mb, load_onnx_model
+            self.model, onnx_dir = load_onnx_model(
+                model_name, revision, onnx_cache_dir,
+                num_threads=self.threads["num_threads"] if self.threads else None,
+                local_files_only=local_files_only,
+            )
+            self.model_size_mb = export_size_mb(onnx_dir)
+        else:
+            # Since transformers 4.51 (the minimum in requirements.txt)
+            # from_pretrained always builds the model without allocating
+            # weights and takes them from the memory-mapped checkpoint
+            # (safetensors when the repo has it), so untouched pages stay shared
+            # with the page cache (and with other workers loading the same
+            # files). Older releases allocate the model and copy every weight.
+            self.model = model_class.from_pretrained(model_name, **hub_options)
+            self.model.to(self.device)
+            self.model.eval()
+            
+            if quantize is not None:
+                self._quantize(quantize)
+            self.model_size_mb = self._model_size_mb()
         
-        self.model.to(self.device)
-        self.model.eval()
+        self.encoder = self.model.get_encoder()
+        self.compile_mode = None
+        if compile:
+            self._compile()
         
-        print("Model loaded successfully!")
+        return {
+            "tokenizer": self.tokenizer,
+            "model": self.model,
+            "encoder": self.encoder,
+            "compile_mode": self.compile_mode,
+            "model_size_mb": self.model_size_mb,
+            "revision": resolved,
+        }
+    
+    def close(self) -> None:
+        """Stop using the shared model (it stays loaded until unloaded from the registry)."""
+        model_registry.release(self.registry_key, self)
+    
+    def _quantize(self, mode: str) -> None:
+        """Quantize the loaded model in place of the fp32 weights."""
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(
+                f"Unknown quantization mode '{mode}'. Choose from: {', '.join(QUANTIZATION_MODES)}"
+            )
+        if self.device != "cpu":
+            raise ValueError(f"Quantization mode '{mode}' is only supported on the CPU device")
+        
+        import torch
+        size_before = self._model_size_mb()
+        self.model = torch.ao.quantization.quantize_dynamic(
+            self.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        print(f"Quantized model ({mode}): {size_before:.1f} MB -> {self._model_size_mb():.1f} MB")
+    
+    def _compile(self) -> None:
+        """Compile the encoder and decoder step, or trace the encoder if that fails."""
+        import torch
+        try:
+            if not hasattr(torch, "compile"):
+                raise RuntimeError("torch.compile requires PyTorch 2.0 or newer")
+            # generate() runs the decoder step through model.forward; the
+            # encoder only runs in _encode. Shapes vary, so compile dynamically.
+            self.encoder.forward = torch.compile(self.encoder.forward, dynamic=True)
+            self.model.forward = torch.compile(self.model.forward, dynamic=True)
+            self.compile_mode = "torch.compile"
+        except Exception as e:
+            self._trace_encoder(e)
+        print(f"Compiled model ({self.compile_mode})")
+    
+    def _trace_encoder(self, reason: Exception) -> None:
+        """Fall back to a TorchScript-traced encoder and an eager decoder."""
+        import torch
+        from transformers.modeling_outputs import BaseModelOutput
+        
+        print(f"torch.compile unavailable ({reason}), tracing the encoder with TorchScript")
+        encoder = self.model.get_encoder()
+        # Drop any compiled wrappers installed by _compile
+        encoder.__dict__.pop("forward", None)
+        self.model.__dict__.pop("forward", None)
+        
+        example = {
+            "input_ids": torch.ones(2, 8, dtype=torch.long, device=self.device),
+            "attention_mask": torch.ones(2, 8, dtype=torch.long, device=self.device),
+        }
+        with torch.no_grad():
+            traced = torch.jit.trace(encoder, example_kwarg_inputs=example, strict=False)
+        
+        def run_encoder(**inputs):
+            return BaseModelOutput(last_hidden_state=traced(**inputs)["last_hidden_state"])
+        
+        self.encoder = run_encoder
+        self.compile_mode = "torchscript"
+    
+    def warmup(self, shapes: Optional[Sequence[Tuple[int, int]]] = None) -> None:
+        """
+        Run generations over a range of input lengths and batch sizes.
+        
+        Uses synthetic inputs and leaves the caches, the global RNG state and
+        the adaptive statistics untouched. If compiled kernels fail to build,
+        the model falls back to the TorchScript encoder and warms up again.
+        
+        Args:
+            shapes: (input tokens, batch size) pairs (default: WARMUP_SHAPES)
+        """
+        shapes = shapes or self.WARMUP_SHAPES
+        print(f"Warming up ({len(shapes)} shapes)...")
+        try:
+            self._run_warmup(shapes)
+        except Exception as e:
+            if self.compile_mode != "torch.compile":
+                raise
+            self._trace_encoder(e)
+            self._run_warmup(shapes)
+        print("Warmup complete")
+    
+    @_operation("warmup")
+    def _run_warmup(self, shapes: Sequence[Tuple[int, int]]) -> None:
+        filler = self._tokenize(["The quick brown fox jumps over the lazy dog. " * 64])[0]
+        eos = [self.tokenizer.eos_token_id]
+        # Synthetic encodings go to a disabled cache, not the live one
+        encoder_cache, self.encoder_cache = self.encoder_cache, EncoderCache(max_mb=0)
+        try:
+            with self._seeded(0):
+                for num_tokens, batch_size in shapes:
+                    input_ids = filler[:max(num_tokens - 1, 1)] + eos
+                    # Distinct keys so every row goes through the encoder
+                    texts = [f"<warmup {num_tokens}x{row}>" for row in range(batch_size)]
+                    encodings = {text: (input_ids, None) for text in texts}
+                    self._generate_candidates(
+                        texts, encodings, 3, self.decoding_strategy, max_length=num_tokens,
+                        temperature=1.0, top_k=50, top_p=0.95, diversity_penalty=1.0,
+                        num_beams=5,
+                    )
+        finally:
+            self.encoder_cache = encoder_cache
     
+    def _model_size_mb(self) -> float:
+        """Size of the model weights in megabytes."""
+        import torch
+        # Count each storage once (tied weights share one) without copying
+        # the weights, which would fault in every memory-mapped page
+        storages = {}
+        packed = 0
+        for value in self.model.state_dict().values():
+            if isinstance(value, torch.Tensor) and not value.is_quantized:
+                storage = value.untyped_storage()
+                storages[storage.data_ptr()] = storage.nbytes()
+            else:
+                # Quantized weights are packed objects; measure them serialized
+                buffer = io.BytesIO()
+                torch.save(value, buffer)
+                packed += buffer.tell()
+        return (sum(storages.values()) + packed) / (1024 * 1024)
+    
+    @staticmethod
+    def _load_tokenizer(model_name: str, slow_class, fast_class, use_fast: bool, **kwargs):
+        """Load the fast tokenizer if possible, otherwise the slow one."""
+        if use_fast:
+            try:
+                return fast_class.from_pretrained(model_name, **kwargs)
+            except Exception as e:
+                # e.g. `tokenizers` not installed or no conversion for this vocab
+                print(f"Fast tokenizer unavailable ({e}), using the slow tokenizer")
+        return slow_class.from_pretrained(model_name, **kwargs)
+    
+    @_operation("paraphrase")
     def paraphrase(
         self,
         text: str,
@@ -66,10 +556,16 @@ class AIParaphraser:
         top_p: float = 0.95,
         diversity_penalty: float = 1.0,
         num_beams: int = 5,
+        seed: Optional[int] = None,
+        adaptive: Optional[bool] = None,
+        strategy: Optional[str] = None,
     ) -> List[str]:
         """
         Generate multiple paraphrases using diverse sampling strategies.
         
+        With a `seed` the output is reproducible for the same model, parameters
+        and text, and is served from the result cache when available.
+        
         Args:
             text: Input text to paraphrase
             num_paraphrases: Number of different paraphrases to generate
@@ -77,71 +573,759 @@ class AIParaphraser:
             temperature: Controls randomness (higher = more diverse)
             top_k: Top-k sampling parameter
             top_p: Nucleus sampling parameter
-            diversity_penalty: Penalty for generating similar outputs
-            num_beams: Number of beams for beam search
+            diversity_penalty: Penalty for similar outputs (used by the
+                               'diverse_beam' strategy; 0 runs plain beam
+                               search)
+            num_beams: Minimum number of beams for the 'beam_sample' strategy
+            seed: Optional random seed for reproducible (and cacheable) output
+            adaptive: Stop over-generating once enough unique paraphrases exist
+                      (defaults to the instance's `adaptive` setting)
+            strategy: Decoding strategy (defaults to the instance's
+                      `decoding_strategy`)
         
         Returns:
             List of paraphrased texts
         """
-        # Prepare input (PEGASUS doesn't need prefix, T5 does)
-        input_text = text  # PEGASUS uses text directly for paraphrasing
+        events = self.iter_paraphrase(
+            text,
+            num_paraphrases=num_paraphrases,
+            max_length=max_length,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            diversity_penalty=diversity_penalty,
+            num_beams=num_beams,
+            seed=seed,
+            adaptive=adaptive,
+            strategy=strategy,
+        )
+        return [event["text"] for event in events]
+    
+    @_operation("paraphrase")
+    def iter_paraphrase(
+        self,
+        text: str,
+        num_paraphrases: int = 5,
+        max_length: int = 512,
+        temperature: float = 1.5,
+        top_k: int = 50,
+        top_p: float = 0.95,
+        diversity_penalty: float = 1.0,
+        num_beams: int = 5,
+        seed: Optional[int] = None,
+        adaptive: Optional[bool] = None,
+        strategy: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Generate like `paraphrase`, yielding each paraphrase as soon as it is found.
         
-        # Tokenize input (increased max_length for longer texts)
-        inputs = self.tokenizer(
-            input_text,
-            return_tensors="pt",
-            max_length=1024,  # Increased from 512
-            truncation=True,
-            padding=True
-        ).to(self.device)
+        Takes the same arguments as `paraphrase`. In adaptive mode the first
+        paraphrases arrive after the first round instead of the last one.
         
-        paraphrases = []
+        Yields:
+            Events {"type": "paraphrase", "index": n, "text": paraphrase}
+        """
+        params = self._paraphrase_params(
+            num_paraphrases=num_paraphrases,
+            max_length=max_length,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            diversity_penalty=diversity_penalty,
+            num_beams=num_beams,
+            adaptive=adaptive,
+            strategy=strategy,
+        )
+        key = self._result_key("paraphrase", text, params, seed)
+        cached = self._lookup_result(key) if key is not None else None
+        if cached is not None:
+            yield from self._paraphrase_events(cached)
+            return
         
-        # Generate paraphrases using diverse sampling
-        with torch.no_grad():
-            # Generate more outputs than requested to ensure diversity after filtering
-            actual_num_to_generate = num_paraphrases * 3  # Generate 3x more
-            
-            # Use beam search with sampling for diversity and quality
-            outputs = self.model.generate(
-                **inputs,
-                max_length=max_length,
-                num_return_sequences=actual_num_to_generate,
-                num_beams=max(actual_num_to_generate, 5),
+        paraphrases: List[str] = []
+        for _, new, _ in self.iter_paraphrase_many([text], seed=seed, **params):
+            yield from self._paraphrase_events(new, start=len(paraphrases))
+            paraphrases.extend(new)
+        
+        if key is not None:
+            self._store_result(key, paraphrases)
+    
+    def _paraphrase_params(
+        self,
+        num_paraphrases: int = 5,
+        max_length: int = 512,
+        temperature: float = 1.5,
+        top_k: int = 50,
+        top_p: float = 0.95,
+        diversity_penalty: float = 1.0,
+        num_beams: int = 5,
+        adaptive: Optional[bool] = None,
+        strategy: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Generation settings of a `paraphrase` call, with the instance defaults filled in."""
+        return dict(
+            adaptive=self.adaptive if adaptive is None else adaptive,
+            strategy=self._check_strategy(strategy or self.decoding_strategy),
+            num_paraphrases=num_paraphrases,
+            max_length=max_length,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            diversity_penalty=diversity_penalty,
+            num_beams=num_beams,
+        )
+    
+    @staticmethod
+    def _paraphrase_events(paraphrases: List[str], start: int = 0) -> Iterator[Dict[str, Any]]:
+        """Wrap finished paraphrases as stream events, numbered from `start`."""
+        for index, paraphrase in enumerate(paraphrases, start):
+            yield {"type": "paraphrase", "index": index, "text": paraphrase}
+    
+    @_operation("many")
+    def paraphrase_many(
+        self,
+        texts: List[str],
+        num_paraphrases: int = 5,
+        max_length: int = 512,
+        temperature: float = 1.5,
+        top_k: int = 50,
+        top_p: float = 0.95,
+        diversity_penalty: float = 1.0,
+        num_beams: int = 5,
+        batch_size: int = 8,
+        max_batch_tokens: Optional[int] = None,
+        sampling_params: Optional[List[Dict[str, float]]] = None,
+        seed: Optional[int] = None,
+        adaptive: Optional[bool] = None,
+        strategy: Optional[str] = None,
+    ) -> List[List[str]]:
+        """
+        Generate paraphrases for several texts using padded, batched generation.
+        
+        Inputs are grouped by token length so that each group pads to a similar
+        length, and every group runs through a single `generate` call. Repeated
+        texts within a batch share one encoder pass.
+        
+        Args:
+            texts: Input texts to paraphrase
+            num_paraphrases: Number of paraphrases per text
+            max_length: Maximum length of generated text; the actual budget
+                        is derived from each batch's input length
+            temperature: Controls randomness (higher = more diverse)
+            top_k: Top-k sampling parameter
+            top_p: Nucleus sampling parameter
+            diversity_penalty: Penalty for similar outputs (used by the
+                               'diverse_beam' strategy; 0 runs plain beam
+                               search)
+            num_beams: Minimum number of beams for the 'beam_sample' strategy
+            batch_size: Maximum number of texts per `generate` call
+            max_batch_tokens: Optional cap on padded input tokens per batch
+                              (texts in batch x longest text in batch)
+            sampling_params: Optional per-text dicts overriding `temperature`,
+                             `top_k` and `top_p`; rows are then sampled with
+                             their own settings inside the same batch
+            seed: Optional random seed; the same texts, parameters and seed
+                  give the same output
+            adaptive: Generate candidates in rounds and stop once enough
+                      unique paraphrases exist (defaults to the instance's
+                      `adaptive` setting)
+            strategy: Decoding strategy (defaults to the instance's
+                      `decoding_strategy`)
+        
+        Returns:
+            List of paraphrase lists, in the same order as `texts`
+        """
+        results: List[List[str]] = [[] for _ in texts]
+        for index, paraphrases, _ in self.iter_paraphrase_many(
+            texts,
+            num_paraphrases=num_paraphrases,
+            max_length=max_length,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            diversity_penalty=diversity_penalty,
+            num_beams=num_beams,
+            batch_size=batch_size,
+            max_batch_tokens=max_batch_tokens,
+            sampling_params=sampling_params,
+            seed=seed,
+            adaptive=adaptive,
+            strategy=strategy,
+        ):
+            results[index].extend(paraphrases)
+        return results
+    
+    @_operation("many")
+    def iter_paraphrase_many(
+        self,
+        texts: List[str],
+        num_paraphrases: int = 5,
+        max_length: int = 512,
+        temperature: float = 1.5,
+        top_k: int = 50,
+        top_p: float = 0.95,
+        diversity_penalty: float = 1.0,
+        num_beams: int = 5,
+        batch_size: int = 8,
+        max_batch_tokens: Optional[int] = None,
+        sampling_params: Optional[List[Dict[str, float]]] = None,
+        seed: Optional[int] = None,
+        adaptive: Optional[bool] = None,
+        strategy: Optional[str] = None,
+    ) -> Iterator[Tuple[int, List[str], bool]]:
+        """
+        Generate like `paraphrase_many`, yielding paraphrases as each round finishes.
+        
+        Takes the same arguments as `paraphrase_many`. Batches run in order of
+        input length, so texts finish out of input order.
+        
+        Yields:
+            Tuples of (index into `texts`, new paraphrases for that text,
+            whether the text is finished); the paraphrases yielded for a text
+            add up to what `paraphrase_many` returns for it
+        """
+        if not texts:
+            return
+        
+        strategy = self._check_strategy(strategy or self.decoding_strategy)
+        if adaptive is None:
+            adaptive = self.adaptive
+        # Deterministic strategies would repeat themselves in every round
+        adaptive = adaptive and DECODING_STRATEGIES[strategy]["sampled"]
+        
+        # Token ids (and encoder states when cached) for every distinct text
+        encodings = self._lookup_encodings(texts)
+        lengths = [len(encodings[text][0]) for text in texts]
+        
+        # Generate more outputs than requested to ensure diversity after filtering.
+        # The fixed mode spends the whole budget at once; the adaptive mode
+        # spends it in rounds and stops as soon as every text has enough.
+        max_candidates = num_paraphrases * 3  # Generate up to 3x more
+        
+        results: List[List[str]] = [[] for _ in texts]
+        seen: List[set] = [set() for _ in texts]
+        generated = [0] * len(texts)
+        
+        with self._seeded(seed):
+            for batch in self._make_batches(lengths, batch_size, max_batch_tokens):
+                pending = batch
+                rate = self._uniqueness_rate(seed)
+                if adaptive:
+                    round_size = self._first_round_size(num_paraphrases, max_candidates, rate)
+                else:
+                    round_size = max_candidates
+                first_round = True
+                
+                while pending:
+                    all_candidates = self._generate_candidates(
+                        [texts[i] for i in pending],
+                        encodings,
+                        num_return_sequences=round_size,
+                        strategy=strategy,
+                        max_length=max_length,
+                        temperature=temperature,
+                        top_k=top_k,
+                        top_p=top_p,
+                        diversity_penalty=diversity_penalty,
+                        num_beams=num_beams,
+                        sampling_params=(
+                            [sampling_params[i] for i in pending]
+                            if sampling_params is not None else None
+                        ),
+                    )
+                    
+                    new_unique = 0
+                    before_round = {}
+                    with self._stage(
+                        "dedup", texts=len(pending), candidates=round_size * len(pending)
+                    ) as span:
+                        for index, candidates in zip(pending, all_candidates):
+                            before = len(results[index])
+                            self._collect_paraphrases(
+                                texts[index], candidates, results[index], seen[index]
+                            )
+                            new_unique += len(results[index]) - before
+                            generated[index] += round_size
+                            before_round[index] = before
+                        span["unique"] = new_unique
+                    if self.metrics is not None:
+                        self.metrics.candidates.inc(
+                            round_size * len(pending), model=self.model_name, mode=self._mode()
+                        )
+                    
+                    if first_round:
+                        self._record_uniqueness(new_unique / (round_size * len(pending)))
+                        first_round = False
+                    
+                    this_round = pending
+                    if adaptive:
+                        pending = [
+                            i for i in pending
+                            if len(results[i]) < num_paraphrases and generated[i] < max_candidates
+                        ]
+                        if pending:
+                            missing = max(num_paraphrases - len(results[i]) for i in pending)
+                            remaining = min(max_candidates - generated[i] for i in pending)
+                            round_size = min(self._round_size_for(missing, rate), remaining)
+                    else:
+                        pending = []
+                    
+                    # Only the requested number is ever handed out
+                    for index in this_round:
+                        new = results[index][before_round[index]:num_paraphrases]
+                        done = index not in pending
+                        if new and self.metrics is not None:
+                            self.metrics.returned.inc(
+                                len(new), model=self.model_name, mode=self._mode()
+                            )
+                        if new or done:
+                            yield index, new, done
+    
+    def _generate_candidates(
+        self,
+        texts: List[str],
+        encodings: Dict[str, tuple],
+        num_return_sequences: int,
+        strategy: str,
+        max_length: int,
+        temperature: float,
+        top_k: int,
+        top_p: float,
+        diversity_penalty: float,
+        num_beams: int,
+        sampling_params: Optional[List[Dict[str, float]]] = None,
+    ) -> List[List[str]]:
+        """
+        Run one batched `generate` call and decode the raw candidates.
+        
+        Returns:
+            One list of `num_return_sequences` decoded candidates per text
+        """
+        import torch
+        from transformers import LogitsProcessorList
+        from sampling import RowSamplingLogitsProcessor
+        
+        k = num_return_sequences
+        
+        # Budget the output from the input: paraphrases are about as long as
+        # their source, so a short sentence never decodes hundreds of tokens
+        longest_input = max(len(encodings[text][0]) for text in texts)
+        max_new_tokens = min(
+            max_length,
+            math.ceil(longest_input * self.length_ratio) + self.length_slack,
+        )
+        
+        generation_kwargs = self._strategy_kwargs(strategy, k, num_beams, diversity_penalty)
+        
+        sampled = DECODING_STRATEGIES[strategy]["sampled"]
+        if sampled and sampling_params is None:
+            generation_kwargs.update(
                 temperature=temperature,
-                do_sample=True,
                 top_k=top_k,
                 top_p=top_p,
-                repetition_penalty=1.2,  # Penalize repetition
-                no_repeat_ngram_size=3,  # Avoid repeating 3-grams
-                pad_token_id=self.tokenizer.pad_token_id,
-                eos_token_id=self.tokenizer.eos_token_id,
             )
+        elif sampled:
+            processor = RowSamplingLogitsProcessor(
+                temperatures=[p.get("temperature", temperature) for p in sampling_params],
+                top_ks=[p.get("top_k", top_k) for p in sampling_params],
+                top_ps=[p.get("top_p", top_p) for p in sampling_params],
+            )
+            # Neutralise the batch-wide warpers; the processor does the work
+            generation_kwargs.update(
+                temperature=1.0,
+                top_k=0,
+                top_p=1.0,
+                logits_processor=LogitsProcessorList([processor]),
+            )
+        
+        with torch.no_grad():
+            attention_mask, encoder_outputs = self._encode(texts, encodings)
+            
+            with self._stage(
+                "generate",
+                texts=len(texts),
+                input_tokens=sum(len(encodings[text][0]) for text in texts),
+                num_beams=generation_kwargs["num_beams"],
+                num_return_sequences=k,
+                max_new_tokens=max_new_tokens,
+                strategy=strategy,
+            ) as span:
+                outputs = self.model.generate(
+                    encoder_outputs=encoder_outputs,
+                    attention_mask=attention_mask,
+                    max_new_tokens=max_new_tokens,
+                    num_return_sequences=k,
+                    repetition_penalty=1.2,  # Penalize repetition
+                    no_repeat_ngram_size=3,  # Avoid repeating 3-grams
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                    **generation_kwargs,
+                )
+                if self._observed():
+                    span["output_tokens"] = int((outputs != self.tokenizer.pad_token_id).sum())
         
-        # Decode outputs
-        for output in outputs:
-            paraphrase = self.tokenizer.decode(output, skip_special_tokens=True)
+        # Outputs are grouped per input: rows [j*k, (j+1)*k) belong to texts[j]
+        with self._stage("decode", sequences=len(outputs)):
+            decoded = self._decode(outputs)
+        return [decoded[j * k:(j + 1) * k] for j in range(len(texts))]
+    
+    @staticmethod
+    def _strategy_kwargs(
+        strategy: str, k: int, num_beams: int, diversity_penalty: float
+    ) -> Dict[str, Any]:
+        """`generate` arguments selecting `strategy` for `k` sequences per input."""
+        if strategy == "diverse_beam":
+            if diversity_penalty < 0:
+                raise ValueError(
+                    f"diversity_penalty must be 0 or more for the 'diverse_beam' strategy, "
+                    f"got {diversity_penalty}"
+                )
+            # One beam per group; groups are pushed apart by the penalty.
+            # Without a penalty the groups would be plain beam search, which
+            # transformers refuses to run as group beam search, so use one group.
+            # early_stopping ends the search as soon as every beam has a
+            # finished hypothesis instead of trying to improve on them.
+            groups = k if diversity_penalty > 0 else 1
+            return dict(
+                do_sample=False,
+                num_beams=k,
+                num_beam_groups=groups,
+                diversity_penalty=diversity_penalty if groups > 1 else 0.0,
+                early_stopping=True,
+            )
+        if strategy == "sample":
+            return dict(
+                do_sample=True,
+                num_beams=1,
+            )
+        # Use beam search with sampling for diversity and quality
+        return dict(
+            do_sample=True,
+            num_beams=max(k, num_beams),
+            early_stopping=True,
+        )
+    
+    @staticmethod
+    def _check_strategy(strategy: str) -> str:
+        """Validate a decoding strategy name."""
+        if strategy not in DECODING_STRATEGIES:
+            raise ValueError(
+                f"Unknown decoding strategy '{strategy}'. "
+                f"Choose from: {', '.join(DECODING_STRATEGIES)}"
+            )
+        return strategy
+    
+    def _uniqueness_rate(self, seed: Optional[int]) -> float:
+        """Expected uniqueness rate to plan rounds with (fixed for seeded calls)."""
+        if seed is not None:
+            return self.DEFAULT_UNIQUENESS_RATE
+        return self._uniqueness_rates.get(self.model_name, self.DEFAULT_UNIQUENESS_RATE)
+    
+    def _first_round_size(self, num_paraphrases: int, max_candidates: int, rate: float) -> int:
+        """Candidates to request up front in adaptive mode."""
+        return max(
+            num_paraphrases, min(self._round_size_for(num_paraphrases, rate), max_candidates)
+        )
+    
+    def _round_size_for(self, missing: int, rate: float) -> int:
+        """Candidates expected to yield `missing` more unique paraphrases at `rate`."""
+        return max(2, math.ceil(missing * self.ROUND_MARGIN / max(rate, 0.05)))
+    
+    def _record_uniqueness(self, rate: float) -> None:
+        """Fold a first-round uniqueness rate into the per-model moving average."""
+        previous = self._uniqueness_rates.get(self.model_name, self.DEFAULT_UNIQUENESS_RATE)
+        self._uniqueness_rates[self.model_name] = 0.8 * previous + 0.2 * rate
+    
+    def _result_key(
+        self, mode: str, text: str, params: Dict, seed: Optional[int]
+    ) -> Optional[tuple]:
+        """Result-cache key for a seeded request; None for unseeded ones."""
+        if seed is None:
+            # Unseeded output is random by design, so never serve it from cache
+            return None
+        
+        # Instance-level settings that change the output are part of the key
+        params = dict(params)
+        params.setdefault("adaptive", self.adaptive)
+        params.setdefault("strategy", self.decoding_strategy)
+        params.setdefault("length_budget", (self.length_ratio, self.length_slack))
+        return ResultCache.make_key(mode, self.model_id, text, params, seed)
+    
+    def cached_result(
+        self,
+        mode: str,
+        text: str,
+        num_paraphrases: int = 5,
+        seed: Optional[int] = None,
+        **params
+    ) -> Optional[List[str]]:
+        """
+        Return the cached result of a seeded call without generating anything.
+        
+        Lets callers such as the scheduler answer repeated requests on their
+        own thread instead of queueing them for the model.
+        
+        Args:
+            mode: 'paraphrase' or 'paragraph', the call to look up
+            text: Input text of the call
+            num_paraphrases: Number of paraphrases requested
+            seed: The call's seed (unseeded calls are never cached)
+            **params: The call's other arguments
+        
+        Returns:
+            The cached paraphrases, or None when there are none
+        """
+        if seed is None:
+            return None
+        if mode == "paraphrase":
+            params = self._paraphrase_params(num_paraphrases, **params)
+        elif mode == "paragraph":
+            first_alone = params.pop("first_alone", False)
+            params = self._paragraph_params(num_paraphrases, first_alone, params)
+        else:
+            raise ValueError(f"Unknown mode '{mode}'. Choose from: paraphrase, paragraph")
+        return self._lookup_result(self._result_key(mode, text, params, seed))
+    
+    def _lookup_result(self, key: tuple) -> Optional[List[str]]:
+        """Return a cached result from memory or the persistent store, if any."""
+        cached = self.result_cache.get_result(key)
+        if cached is None and self.result_store is not None:
+            cached = self.result_store.get_result(key)
+            if cached is not None:
+                self.result_cache.put_result(key, cached)
+        
+        root = self._root_span()
+        if root is not None:
+            root.attributes["cached"] = cached is not None
+        return cached
+    
+    def _store_result(self, key: tuple, result: List[str]) -> None:
+        """Save a finished result in the memory cache and the persistent store."""
+        self.result_cache.put_result(key, result)
+        if self.result_store is not None:
+            self.result_store.put_result(key, result)
+    
+    @contextmanager
+    def _seeded(self, seed: Optional[int]):
+        """Seed torch's RNG for the block, restoring the previous state afterwards."""
+        if seed is None:
+            yield
+            return
+        
+        import torch
+        devices = range(torch.cuda.device_count()) if self.device.startswith("cuda") else []
+        with torch.random.fork_rng(devices=devices):
+            torch.manual_seed(seed)
+            yield
+    
+    @contextmanager
+    def _labeled(self, mode: str):
+        """Run the block as part of a `mode` call (see `_operation`)."""
+        stack = getattr(self._calls, "modes", None)
+        if stack is None:
+            stack = self._calls.modes = []
+        root = not stack
+        if root and self.metrics is not None:
+            self.metrics.calls.inc(model=self.model_name, mode=mode)
+        # Unique entry: a generator may be closed after later calls started.
+        # The outermost call's entry carries its root span when tracing.
+        if root and self.tracer is not None:
+            entry = (mode, Span(mode, time.perf_counter(), {"model": self.model_name}))
+        else:
+            entry = (mode, object())
+        stack.append(entry)
+        try:
+            yield
+        finally:
+            if entry in stack:
+                stack.remove(entry)
+            if isinstance(entry[1], Span):
+                entry[1].end = time.perf_counter()
+                self.tracer.on_span(entry[1])
+    
+    def _mode(self) -> str:
+        """Label of the outermost public call in progress on this thread."""
+        stack = getattr(self._calls, "modes", None)
+        return stack[0][0] if stack else "many"
+    
+    def _root_span(self) -> Optional[Span]:
+        """Span of the outermost public call in progress on this thread, if traced."""
+        stack = getattr(self._calls, "modes", None)
+        if stack and isinstance(stack[0][1], Span):
+            return stack[0][1]
+        return None
+    
+    def _observed(self) -> bool:
+        """True when stages are timed for metrics or tracing."""
+        return self.metrics is not None or self.tracer is not None
+    
+    @contextmanager
+    def _stage(self, name: str, **attributes):
+        """
+        Time the block as stage `name` of the current call for metrics and tracing.
+        
+        Yields the span attributes, which the block can add to (e.g. counts
+        only known once the stage has run).
+        """
+        if not self._observed():
+            yield attributes
+            return
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            end = time.perf_counter()
+            if self.metrics is not None:
+                mode = self._mode()
+                self.metrics.observe_stage(self.model_name, mode, name, end - start)
+                if name == "generate" and "output_tokens" in attributes:
+                    self.metrics.observe_generate(
+                        self.model_name, mode, attributes["output_tokens"], end - start
+                    )
+            if self.tracer is not None:
+                span = Span(name, start, attributes, parent=self._root_span())
+                span.end = end
+                self.tracer.on_span(span)
+    
+    def _lookup_encodings(self, texts: List[str]) -> Dict[str, tuple]:
+        """
+        Map each distinct text to (input_ids, hidden_states).
+        
+        Texts found in the encoder cache come back with their hidden states;
+        the rest are tokenized together in one call and get `None` for the
+        hidden states until `_encode` computes them.
+        """
+        encodings = {}
+        for text in dict.fromkeys(texts):
+            encodings[text] = self.encoder_cache.get_encoding(self.model_id, text)
+        
+        missing = [text for text, entry in encodings.items() if entry is None]
+        if missing:
+            with self._stage("tokenize", texts=len(missing)) as span:
+                token_ids = self._tokenize(missing)
+                span["input_tokens"] = sum(len(ids) for ids in token_ids)
+            for text, ids in zip(missing, token_ids):
+                encodings[text] = (ids, None)
+        
+        return encodings
+    
+    def _tokenize(self, texts: List[str]) -> List[List[int]]:
+        """
+        Tokenize texts in one call, without padding.
+        
+        Padding happens per batch (to the longest input in that batch), so
+        short inputs are never padded out to the truncation limit.
+        """
+        return self.tokenizer(
+            texts,
+            max_length=1024,  # Increased from 512
+            truncation=True,
+        )["input_ids"]
+    
+    def _decode(self, outputs) -> List[str]:
+        """Detokenize a batch of generated sequences in one call."""
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+    
+    def _encode(self, texts: List[str], encodings: Dict[str, tuple]):
+        """
+        Build padded encoder outputs for a batch of texts.
+        
+        Only texts without cached hidden states go through the encoder, and
+        repeated texts are encoded once. New states are stored (unpadded) in
+        `encodings` and the encoder cache.
+        
+        Returns:
+            Tuple of (attention_mask, encoder_outputs) with one row per text
+        """
+        import torch
+        from transformers.modeling_outputs import BaseModelOutput
+        
+        pending = [text for text in dict.fromkeys(texts) if encodings[text][1] is None]
+        if pending:
+            with self._stage(
+                "encode",
+                texts=len(pending),
+                input_tokens=sum(len(encodings[text][0]) for text in pending),
+            ):
+                inputs = self.tokenizer.pad(
+                    {"input_ids": [encodings[text][0] for text in pending]},
+                    padding=True,
+                    return_tensors="pt",
+                ).to(self.device)
+                hidden_states = self.encoder(**inputs).last_hidden_state
+            
+            for row, text in enumerate(pending):
+                input_ids = encodings[text][0]
+                # Inputs are right-padded; clone so the cache doesn't pin the batch
+                states = hidden_states[row, :len(input_ids)].clone()
+                encodings[text] = (input_ids, states)
+                self.encoder_cache.put_encoding(self.model_id, text, input_ids, states)
+        
+        rows = [encodings[text][1] for text in texts]
+        lengths = torch.tensor([len(encodings[text][0]) for text in texts], device=self.device)
+        positions = torch.arange(max(lengths).item(), device=self.device)
+        attention_mask = (positions.unsqueeze(0) < lengths.unsqueeze(1)).long()
+        encoder_outputs = BaseModelOutput(
+            last_hidden_state=torch.nn.utils.rnn.pad_sequence(rows, batch_first=True)
+        )
+        return attention_mask, encoder_outputs
+    
+    @staticmethod
+    def _make_batches(
+        lengths: List[int],
+        batch_size: int,
+        max_batch_tokens: Optional[int] = None,
+    ) -> List[List[int]]:
+        """Group input indices into length-sorted batches within the size/token limits."""
+        batches = []
+        current: List[int] = []
+        current_max = 0
+        
+        for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+            longest = max(current_max, lengths[index])
+            too_many = len(current) >= batch_size
+            too_long = (
+                max_batch_tokens is not None
+                and (len(current) + 1) * longest > max_batch_tokens
+            )
+            if current and (too_many or too_long):
+                batches.append(current)
+                current, longest = [], lengths[index]
+            current.append(index)
+            current_max = longest
+        
+        if current:
+            batches.append(current)
+        
+        return batches
+    
+    @staticmethod
+    def _collect_paraphrases(
+        text: str,
+        candidates: List[str],
+        paraphrases: List[str],
+        seen: set,
+    ) -> None:
+        """
+        Append usable candidates to `paraphrases` in order.
+        
+        Empty outputs, copies of the input and duplicates (compared on the
+        normalized text, tracked in `seen`) are dropped.
+        """
+        for paraphrase in candidates:
             if paraphrase and paraphrase.strip():
                 # Clean up the paraphrase
                 paraphrase = paraphrase.strip()
                 # Only add if it's different from the original
-                if paraphrase.lower() != text.lower():
+                if paraphrase.lower() == text.lower():
+                    continue
+                # Use normalized version for duplicate comparison
+                normalized = ' '.join(paraphrase.lower().split())
+                if normalized not in seen:
+                    seen.add(normalized)
                     paraphrases.append(paraphrase)
-        
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_paraphrases = []
-        for p in paraphrases:
-            # Use normalized version for comparison
-            normalized = ' '.join(p.lower().split())
-            if normalized not in seen:
-                seen.add(normalized)
-                unique_paraphrases.append(p)
-        
-        # Return only the requested number
-        return unique_paraphrases[:num_paraphrases]
     
-    def _split_into_sentences(self, text: str) -> List[str]:
+    def split_sentences(self, text: str) -> List[str]:
         """Split text into sentences, handling semicolons and periods."""
         # Split on periods, exclamation marks, question marks, and semicolons
         # But keep semicolons as part of the sentence for now
@@ -159,52 +1343,146 @@ class AIParaphraser:
         
         return [s for s in all_sentences if s and len(s) > 10]  # Filter very short fragments
     
+    @_operation("paragraph")
     def paraphrase_paragraph(
         self,
         text: str,
         num_paraphrases: int = 5,
+        seed: Optional[int] = None,
         **kwargs
     ) -> List[str]:
         """
-        Paraphrase longer texts (paragraphs) by processing sentence by sentence.
+        Paraphrase longer texts (paragraphs) by paraphrasing each sentence.
         Better for multi-sentence inputs.
         
         Args:
             text: Input paragraph to paraphrase
             num_paraphrases: Number of paragraph variations to generate
-            **kwargs: Additional parameters for paraphrase method
+            seed: Optional random seed for reproducible (and cacheable) output
+            **kwargs: Additional parameters for paraphrase_many (generation
+                      settings, batch_size, max_batch_tokens)
         
         Returns:
             List of paraphrased paragraphs
         """
+        events = self.iter_paraphrase_paragraph(text, num_paraphrases, seed, **kwargs)
+        return [event["text"] for event in events if event["type"] == "paraphrase"]
+    
+    @_operation("paragraph")
+    def iter_paraphrase_paragraph(
+        self,
+        text: str,
+        num_paraphrases: int = 5,
+        seed: Optional[int] = None,
+        first_alone: bool = False,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Paraphrase a paragraph like `paraphrase_paragraph`, yielding progress events.
+        
+        Each sentence is reported as soon as its variations are done; the
+        paragraphs follow once every sentence is. Sentences are generated in
+        one batch by default; with `first_alone` the first sentence is
+        generated on its own, so it comes back after one sentence's worth of
+        generation, and the remaining sentences share the batch after it.
+        
+        Args:
+            text: Input paragraph to paraphrase
+            num_paraphrases: Number of paragraph variations to generate
+            seed: Optional random seed for reproducible (and cacheable) output
+            first_alone: Generate the first sentence before the others
+            **kwargs: Additional parameters for paraphrase_many
+        
+        Yields:
+            {"type": "sentence", "index", "total", "sentence", "variations"}
+            per sentence (in order of completion), then
+            {"type": "paraphrase", "index", "text"} per paragraph
+        """
+        key = self._result_key(
+            "paragraph", text, self._paragraph_params(num_paraphrases, first_alone, kwargs), seed
+        )
+        cached = self._lookup_result(key) if key is not None else None
+        if cached is not None:
+            yield from self._paraphrase_events(cached)
+            return
+        
         # Split into sentences
-        sentences = self._split_into_sentences(text)
+        sentences = self.split_sentences(text)
         
+        paragraphs: List[str] = []
         if len(sentences) <= 1:
             # Single sentence, use regular paraphrase
-            return self.paraphrase(text, num_paraphrases=num_paraphrases, **kwargs)
+            for _, new, _ in self.iter_paraphrase_many(
+                [text], num_paraphrases=num_paraphrases, seed=seed, **kwargs
+            ):
+                yield from self._paraphrase_events(new, start=len(paragraphs))
+                paragraphs.extend(new)
+        else:
+            variations_per_sentence = self.variations_per_sentence(num_paraphrases)
+            
+            # Paraphrase all sentences together: one batched generate call unless the
+            # caller limits it with batch_size / max_batch_tokens
+            kwargs.setdefault("batch_size", len(sentences))
+            print(f"Paraphrasing {len(sentences)} sentences...")
+            sentence_variations: List[List[str]] = [[] for _ in sentences]
+            if first_alone:
+                groups = [[0], list(range(1, len(sentences)))]
+            else:
+                groups = [list(range(len(sentences)))]
+            for group in groups:
+                for position, new, finished in self.iter_paraphrase_many(
+                    [sentences[i] for i in group],
+                    num_paraphrases=variations_per_sentence,
+                    seed=seed,
+                    **kwargs
+                ):
+                    index = group[position]
+                    sentence_variations[index].extend(new)
+                    if finished:
+                        if not sentence_variations[index]:
+                            # Keep original if no variations
+                            sentence_variations[index].append(sentences[index])
+                        yield {
+                            "type": "sentence",
+                            "index": index,
+                            "total": len(sentences),
+                            "sentence": sentences[index],
+                            "variations": list(sentence_variations[index]),
+                        }
+            
+            with self._stage("assemble", sentences=len(sentences)) as span:
+                paragraphs = self.combine_sentences(sentence_variations, num_paraphrases, seed)
+                span["paraphrases"] = len(paragraphs)
+            yield from self._paraphrase_events(paragraphs)
         
+        if key is not None:
+            self._store_result(key, paragraphs)
+    
+    @staticmethod
+    def _paragraph_params(num_paraphrases: int, first_alone: bool, kwargs: Dict) -> Dict:
+        """Settings of a `paraphrase_paragraph` call that identify its result."""
+        params = dict(num_paraphrases=num_paraphrases, **kwargs)
+        if first_alone:
+            params["first_alone"] = True
+        return params
+    
+    @staticmethod
+    def variations_per_sentence(num_paraphrases: int) -> int:
+        """Variations to generate per sentence for `num_paraphrases` paragraphs."""
         # Calculate how many variations we need per sentence to get enough combinations
         # We want at least num_paraphrases * 2 to ensure enough variety
-        variations_per_sentence = max(4, num_paraphrases)
-        
-        # Paraphrase each sentence
-        sentence_variations = []
-        for i, sentence in enumerate(sentences):
-            print(f"Paraphrasing sentence {i+1}/{len(sentences)}...")
-            variations = self.paraphrase(
-                sentence, 
-                num_paraphrases=variations_per_sentence,
-                **kwargs
-            )
-            if variations:
-                sentence_variations.append(variations)
-            else:
-                sentence_variations.append([sentence])  # Keep original if no variations
-        
+        return max(4, num_paraphrases)
+    
+    @staticmethod
+    def combine_sentences(
+        sentence_variations: List[List[str]],
+        num_paraphrases: int,
+        seed: Optional[int],
+    ) -> List[str]:
+        """Combine per-sentence variations into distinct paragraph variations."""
         # Combine sentences to create paragraph variations
         paragraph_variations = []
-        import random
+        rng = random.Random(seed)
         
         # Generate combinations with some randomness
         attempts = 0
@@ -221,7 +1499,7 @@ class AIParaphraser:
                     idx = attempts % len(variations)
                 else:
                     # After that: pick randomly for more diversity
-                    idx = random.randint(0, len(variations) - 1)
+                    idx = rng.randint(0, len(variations) - 1)
                 paragraph_parts.append(variations[idx])
             
             # Join into paragraph
@@ -234,89 +1512,98 @@ class AIParaphraser:
         
         return paragraph_variations[:num_paraphrases]
     
+    @_operation("styles")
     def paraphrase_with_styles(
         self,
         text: str,
         num_per_style: int = 2,
         max_length: int = 128,
+        styles: Optional[Dict[str, Dict[str, float]]] = None,
     ) -> Dict[str, List[str]]:
         """
         Generate paraphrases using different styles/strategies.
         
+        The text is encoded once. Styles that sample with the same strategy
+        share one batch, each applying its own sampling settings to its rows;
+        styles using another strategy get their own `generate` call.
+        
         Args:
             text: Input text to paraphrase
             num_per_style: Number of paraphrases per style
             max_length: Maximum length of generated text
+            styles: Optional mapping of style name to generation parameters
+                    (temperature, top_k, top_p, diversity_penalty, strategy);
+                    defaults to PARAPHRASE_STYLES
         
         Returns:
             Dictionary mapping style names to lists of paraphrases
         """
-        styles = {
-            "conservative": {
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "diversity_penalty": 0.5,
-            },
-            "balanced": {
-                "temperature": 1.2,
-                "top_p": 0.95,
-                "diversity_penalty": 1.0,
-            },
-            "creative": {
-                "temperature": 1.8,
-                "top_p": 0.98,
-                "diversity_penalty": 1.5,
-            },
-            "diverse": {
-                "temperature": 2.0,
-                "top_p": 0.99,
-                "diversity_penalty": 2.0,
-            },
-        }
+        if styles is None:
+            styles = PARAPHRASE_STYLES
         
-        results = {}
+        # Styles can only share a batch if they decode the same way
+        groups: Dict[tuple, List[str]] = {}
+        for name, params in styles.items():
+            strategy = self._check_strategy(params.get("strategy", self.decoding_strategy))
+            penalty = params.get("diversity_penalty") if strategy == "diverse_beam" else None
+            groups.setdefault((strategy, penalty), []).append(name)
         
-        for style_name, params in styles.items():
-            print(f"Generating {style_name} paraphrases...")
-            paraphrases = self.paraphrase(
-                text,
+        print(f"Generating {', '.join(styles)} paraphrases...")
+        results = {}
+        for (strategy, penalty), names in groups.items():
+            group_kwargs = {"diversity_penalty": penalty} if penalty is not None else {}
+            all_paraphrases = self.paraphrase_many(
+                [text] * len(names),
                 num_paraphrases=num_per_style,
                 max_length=max_length,
-                **params
+                batch_size=len(names),
+                sampling_params=[styles[name] for name in names],
+                strategy=strategy,
+                **group_kwargs
             )
-            results[style_name] = paraphrases
+            results.update(zip(names, all_paraphrases))
         
-        return results
+        # Keep the caller's style order
+        return {name: results[name] for name in styles}
     
+    @_operation("batch")
     def batch_paraphrase(
         self,
         texts: List[str],
         num_paraphrases: int = 3,
         max_length: int = 128,
+        batch_size: int = 8,
+        max_batch_tokens: Optional[int] = None,
     ) -> Dict[str, List[str]]:
         """
         Generate paraphrases for multiple texts.
         
+        Texts are bucketed by token length and each bucket is generated in a
+        single padded batch (see `paraphrase_many`).
+        
         Args:
             texts: List of input texts
             num_paraphrases: Number of paraphrases per text
             max_length: Maximum length of generated text
+            batch_size: Maximum number of texts per `generate` call
+            max_batch_tokens: Optional cap on padded input tokens per batch
         
         Returns:
             Dictionary mapping original texts to their paraphrases
         """
-        results = {}
+        # Repeated texts map to the same key, so only generate them once
+        unique_texts = list(dict.fromkeys(texts))
         
-        for text in texts:
-            print(f"Processing: {text[:50]}...")
-            paraphrases = self.paraphrase(
-                text,
-                num_paraphrases=num_paraphrases,
-                max_length=max_length
-            )
-            results[text] = paraphrases
+        print(f"Processing {len(unique_texts)} texts in batches of up to {batch_size}...")
+        all_paraphrases = self.paraphrase_many(
+            unique_texts,
+            num_paraphrases=num_paraphrases,
+            max_length=max_length,
+            batch_size=batch_size,
+            max_batch_tokens=max_batch_tokens,
+        )
         
-        return results
+        return dict(zip(unique_texts, all_paraphrases))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+"""
+Logits processors used by the paraphraser during generation
+"""
+
+import torch
+from transformers import LogitsProcessor
+from typing import List
+
+
+class RowSamplingLogitsProcessor(LogitsProcessor):
+    """
+    Apply temperature, top-k and top-p per input row instead of per batch.
+    
+    `generate` only accepts one temperature/top_k/top_p for the whole batch.
+    This processor carries one value per input text and expands them over the
+    beams/return sequences of that input, so differently tuned requests can
+    share a single decode loop.
+    """
+    
+    def __init__(
+        self,
+        temperatures: List[float],
+        top_ks: List[int],
+        top_ps: List[float],
+        filter_value: float = -float("inf"),
+        min_tokens_to_keep: int = 1,
+    ):
+        self.temperatures = torch.tensor(temperatures, dtype=torch.float)
+        self.top_ks = torch.tensor(top_ks, dtype=torch.long)
+        self.top_ps = torch.tensor(top_ps, dtype=torch.float)
+        self.filter_value = filter_value
+        self.min_tokens_to_keep = min_tokens_to_keep
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        # Rows are laid out input by input (beams / samples of input i are adjacent)
+        rows_per_input = scores.shape[0] // self.temperatures.shape[0]
+        vocab_size = scores.shape[-1]
+        
+        def per_row(values):
+            return values.to(scores.device).repeat_interleave(rows_per_input).unsqueeze(1)
+        
+        scores = scores / per_row(self.temperatures).to(scores.dtype)
+        
+        sorted_scores, sorted_indices = torch.sort(scores, descending=True, dim=-1)
+        ranks = torch.arange(vocab_size, device=scores.device).unsqueeze(0)
+        
+        # Top-k (k <= 0 disables it for that row)
+        top_ks = per_row(self.top_ks)
+        top_ks = torch.where(top_ks > 0, top_ks, torch.full_like(top_ks, vocab_size))
+        remove = ranks >= top_ks
+        
+        # Top-p over what top-k kept, always keeping the token that crosses p
+        probs = sorted_scores.masked_fill(remove, self.filter_value).softmax(dim=-1)
+        cumulative = probs.cumsum(dim=-1)
+        remove |= (cumulative - probs) > per_row(self.top_ps)
+        remove[:, :self.min_tokens_to_keep] = False
+        
+        mask = torch.zeros_like(remove).scatter(1, sorted_indices, remove)
+        return scores.masked_fill(mask, self.filter_value)
@@ -0,0 +1,507 @@
+"""
+Micro-batching scheduler that coalesces concurrent paraphrase requests
+"""
+
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Overloaded(RuntimeError):
+    """The scheduler could not take (or start) a request in time."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        # Seconds the client should wait before trying again
+        self.retry_after = retry_after
+
+
+class QueueFull(Overloaded):
+    """The queue already holds `max_queue` requests."""
+
+
+class QueueTimeout(Overloaded):
+    """The request waited longer than `queue_timeout` without starting."""
+
+
+class _Request:
+    """One submitted request waiting for (or holding) its result."""
+
+    __slots__ = ("kind", "text", "num_paraphrases", "seed", "params", "key",
+                 "tokens", "enqueued_at", "started", "done", "result", "error",
+                 "events", "cancelled")
+
+    def __init__(self, kind, text, num_paraphrases, seed, params):
+        self.kind = kind
+        self.text = text
+        self.num_paraphrases = num_paraphrases
+        self.seed = seed
+        self.params = params
+        # Only unseeded single-text requests with identical settings can share
+        # a generate call (streamed or not); everything else runs on its own
+        if kind in ("paraphrase", "stream") and seed is None:
+            self.key = (num_paraphrases, tuple(sorted(params.items())))
+        else:
+            self.key = None
+        # Counted by the scheduler thread; the tokenizer isn't safe to share
+        # between threads
+        self.tokens = None
+        self.enqueued_at = time.monotonic()
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Streaming requests receive their events here, ending with None
+        self.events = queue.Queue() if kind.startswith("stream") else None
+        self.cancelled = False
+
+
+class BatchScheduler:
+    """
+    Collects requests for a shared AIParaphraser and runs them in batches.
+
+    Request handlers call `paraphrase` / `paraphrase_paragraph` from their own
+    threads and block until the result is ready. A single background thread
+    owns the model: it waits up to `max_wait` seconds after the first queued
+    request for compatible ones to arrive (same settings, no seed), then runs
+    up to `max_batch` of them, or as many as fit in `max_batch_tokens` input
+    tokens, through one `paraphrase_many` call and hands each caller its
+    result; unseeded single-text streams join those batches too. Seeded,
+    paragraph and other streaming requests keep their exact per-request
+    behaviour and run one at a time on the same thread; seeded
+    ones whose result is already cached are answered on the caller's thread
+    without queueing.
+
+    Admission is bounded: once `max_queue` requests are waiting new ones are
+    rejected with `QueueFull` straight away, and a request that can't start
+    within `queue_timeout` seconds is dropped with `QueueTimeout`, so work
+    piles up neither in memory nor past the client's own timeout.
+    """
+
+    def __init__(
+        self,
+        paraphraser,
+        max_batch: int = 8,
+        max_wait: float = 0.01,
+        max_batch_tokens: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        history: int = 100,
+    ):
+        """
+        Args:
+            paraphraser: The AIParaphraser to run requests on
+            max_batch: Maximum number of requests per batch
+            max_wait: Seconds to wait for more requests after the first one
+            max_batch_tokens: Optional cap on the input tokens of a batch
+            max_queue: Maximum number of waiting requests (None: unbounded)
+            queue_timeout: Seconds a request may wait before it starts
+                           (None: no limit)
+            history: Number of recent batches kept for `stats`
+        """
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        if max_queue is not None and max_queue < 1:
+            raise ValueError("max_queue must be at least 1")
+        self.paraphraser = paraphraser
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_batch_tokens = max_batch_tokens
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._queue: "deque[_Request]" = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+        self.requests = 0
+        self.cached = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.recent: "deque[Dict[str, Any]]" = deque(maxlen=history)
+
+    def paraphrase(
+        self, text: str, num_paraphrases: int = 5, seed: Optional[int] = None, **params
+    ) -> List[str]:
+        """Queue a `paraphrase` call and wait for its result."""
+        return self._submit("paraphrase", text, num_paraphrases, seed, params)
+
+    def paraphrase_paragraph(
+        self, text: str, num_paraphrases: int = 5, seed: Optional[int] = None, **params
+    ) -> List[str]:
+        """Queue a `paraphrase_paragraph` call and wait for its result."""
+        return self._submit("paragraph", text, num_paraphrases, seed, params)
+
+    def stream(
+        self,
+        text: str,
+        num_paraphrases: int = 5,
+        seed: Optional[int] = None,
+        paragraph: bool = False,
+        **params
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Queue an `iter_paraphrase` (or `iter_paraphrase_paragraph`) call.
+
+        Blocks until the request has started, so admission errors are raised
+        here rather than half-way through a response, then returns an
+        iterator over its events. Closing the iterator early stops generation
+        after the current round.
+
+        An unseeded single text shares a batch with `paraphrase` requests that
+        have the same settings, like the web page's short inputs, and gets all
+        its paraphrases once the batch is done.
+        """
+        cached = self._cached("paragraph" if paragraph else "paraphrase",
+                              text, num_paraphrases, seed, params)
+        if cached is not None:
+            return self._paraphrase_events(cached)
+        kind = "stream_paragraph" if paragraph else "stream"
+        request = self._admit(kind, text, num_paraphrases, seed, params)
+        self._wait_started(request)
+        return self._events(request)
+
+    def stream_many(
+        self,
+        texts: List[str],
+        num_paraphrases: int = 5,
+        seed: Optional[int] = None,
+        **params
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Queue `iter_paraphrase_many` calls for a list of texts.
+
+        The texts are sorted by length and split into requests of up to
+        `max_batch` texts (or `batch_size` when given), each queued only once
+        the previous one has finished, so other traffic gets the model thread
+        in between instead of waiting behind the whole list. Blocks until the
+        first request has started, like `stream`; later requests that are
+        turned away are retried after their `retry_after`.
+
+        With a `seed` every text instead runs on its own like `paraphrase`,
+        so its output depends only on the text, the seed and the settings,
+        never on the texts around it, and repeated texts come from the
+        result cache.
+
+        Returns:
+            Iterator over {"index": i, "paraphrases": [...]} events, one per
+            text as soon as it is finished, or {"index": i, "error": "..."}
+            for the texts of a request that failed
+        """
+        chunk_size = params.pop("batch_size", None) or self.max_batch
+        if seed is not None:
+            params.pop("max_batch_tokens", None)
+            chunk_size = 1
+        else:
+            params.setdefault("max_batch_tokens", self.max_batch_tokens)
+        # Similar lengths share a request, so they pad to similar lengths
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        chunks = [order[i:i + chunk_size] for i in range(0, len(order), chunk_size)]
+
+        def admit(chunk: List[int]) -> Iterator[Dict[str, Any]]:
+            if seed is not None:
+                events = self.stream(texts[chunk[0]], num_paraphrases, seed, **params)
+                return self._collected(events)
+            request = self._admit(
+                "stream_many", [texts[i] for i in chunk], num_paraphrases, seed,
+                dict(params, batch_size=len(chunk)),
+            )
+            self._wait_started(request)
+            return self._events(request)
+
+        first = admit(chunks[0]) if chunks else None
+        return self._chunked_events(first, chunks, admit)
+
+    def _chunked_events(self, events, chunks, admit) -> Iterator[Dict[str, Any]]:
+        """Yield the events of each chunk's request in turn, remapping text indices."""
+        for chunk in chunks:
+            while events is None:
+                try:
+                    events = admit(chunk)
+                except Overloaded as e:
+                    time.sleep(e.retry_after)
+            finished = set()
+            try:
+                for event in events:
+                    finished.add(event["index"])
+                    yield dict(event, index=chunk[event["index"]])
+            except Exception as e:
+                # Only this chunk's unfinished texts failed; go on with the rest
+                for position, index in enumerate(chunk):
+                    if position not in finished:
+                        yield {"index": index, "error": str(e)}
+            finally:
+                events.close()
+            events = None
+
+    @staticmethod
+    def _collected(events: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Turn a single text's stream events into one `stream_many` event."""
+        try:
+            paraphrases = [event["text"] for event in events if event["type"] == "paraphrase"]
+        finally:
+            events.close()
+        yield {"index": 0, "paraphrases": paraphrases}
+
+    @staticmethod
+    def _paraphrase_events(paraphrases: List[str]) -> Iterator[Dict[str, Any]]:
+        """Stream events for finished paraphrases (a generator, so callers can close it)."""
+        for index, paraphrase in enumerate(paraphrases):
+            yield {"type": "paraphrase", "index": index, "text": paraphrase}
+
+    def _events(self, request: _Request) -> Iterator[Dict[str, Any]]:
+        try:
+            while True:
+                event = request.events.get()
+                if event is None:
+                    break
+                yield event
+            if request.error is not None:
+                raise request.error
+        finally:
+            request.cancelled = True
+
+    def _submit(self, kind, text, num_paraphrases, seed, params) -> List[str]:
+        cached = self._cached(kind, text, num_paraphrases, seed, params)
+        if cached is not None:
+            return cached
+        request = self._admit(kind, text, num_paraphrases, seed, params)
+        self._wait_started(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _cached(self, mode, text, num_paraphrases, seed, params) -> Optional[List[str]]:
+        """The cached result of a seeded request, looked up on the caller's thread."""
+        if seed is None:
+            return None
+        cached = self.paraphraser.cached_result(
+            mode, text, num_paraphrases=num_paraphrases, seed=seed, **params
+        )
+        if cached is not None:
+            with self._cond:
+                self.cached += 1
+        return cached
+
+    def _admit(self, kind, text, num_paraphrases, seed, params) -> _Request:
+        """Queue a request, or reject it with `QueueFull`."""
+        request = _Request(kind, text, num_paraphrases, seed, params)
+        with self._cond:
+            if self.max_queue is not None and len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(
+                    f"Server busy: {len(self._queue)} requests queued", self.retry_after()
+                )
+            self._ensure_thread()
+            self._queue.append(request)
+            self.requests += 1
+            self._cond.notify()
+        return request
+
+    def _wait_started(self, request: _Request) -> None:
+        """Wait for `request` to start, dropping it with `QueueTimeout` after `queue_timeout`."""
+        if request.started.wait(self.queue_timeout):
+            return
+        with self._cond:
+            # Still queued: give up before any work is spent on it. Once its
+            # batch has started the result is worth waiting for.
+            if request in self._queue:
+                self._queue.remove(request)
+                self.timed_out += 1
+                raise QueueTimeout(
+                    f"Request waited more than {self.queue_timeout:g}s in the queue",
+                    self.retry_after(),
+                )
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely drained, from recent batch times."""
+        with self._cond:
+            run = self.total_run / self.batches if self.batches else 1.0
+            batches_ahead = len(self._queue) / self.max_batch + 1
+            return max(1, math.ceil(run * batches_ahead))
+
+    def saturated(self) -> bool:
+        """True while the queue is full and new requests are being rejected."""
+        with self._cond:
+            return self.max_queue is not None and len(self._queue) >= self.max_queue
+
+    def _ensure_thread(self) -> None:
+        """Start the batching thread (again after a fork, where threads don't survive)."""
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="paraphrase-batcher", daemon=True
+            )
+            self._thread.start()
+
+    def _compatible(self, first: _Request) -> List[_Request]:
+        """Queued requests that can join a batch started by `first`, in order."""
+        if first.key is None:
+            return [first]
+
+        batch = []
+        tokens = 0
+        for request in self._queue:
+            if request.key != first.key:
+                continue
+            if (self.max_batch_tokens is not None and batch
+                    and tokens + request.tokens > self.max_batch_tokens):
+                break
+            batch.append(request)
+            tokens += request.tokens
+            if len(batch) >= self.max_batch:
+                break
+        return batch
+
+    def _batch_ready(self, first: _Request, batch: List[_Request], remaining: float) -> bool:
+        """True once `batch` should run rather than wait for more requests."""
+        return (
+            first.key is None
+            or len(batch) >= self.max_batch
+            or remaining <= 0
+            or (self.max_batch_tokens is not None
+                and sum(r.tokens for r in batch) >= self.max_batch_tokens)
+        )
+
+    def _next_batch(self) -> List[_Request]:
+        """Block until a batch is ready and remove it from the queue."""
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+
+                uncounted = [r for r in self._queue if r.key is not None and r.tokens is None]
+                if not uncounted:
+                    first = self._queue[0]
+                    batch = self._compatible(first)
+                    remaining = first.enqueued_at + self.max_wait - time.monotonic()
+                    if self._batch_ready(first, batch, remaining):
+                        for request in batch:
+                            self._queue.remove(request)
+                        return batch
+                    self._cond.wait(remaining)
+                    continue
+
+            # Tokenize without holding the lock, so admission and timeouts
+            # aren't blocked meanwhile
+            for request in uncounted:
+                request.tokens = len(self.paraphraser.tokenizer(request.text)["input_ids"])
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            for request in batch:
+                request.started.set()
+            try:
+                self._execute(batch)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finished = time.monotonic()
+            self._record(batch, started, finished)
+            for request in batch:
+                if request.events is not None:
+                    request.events.put(None)
+                request.done.set()
+
+    def _execute(self, batch: List[_Request]) -> None:
+        first = batch[0]
+        if first.key is not None:
+            results = self.paraphraser.paraphrase_many(
+                [request.text for request in batch],
+                num_paraphrases=first.num_paraphrases,
+                batch_size=len(batch),
+                max_batch_tokens=self.max_batch_tokens,
+                **first.params
+            )
+            for request, result in zip(batch, results):
+                if request.events is None:
+                    request.result = result
+                    continue
+                for event in self._paraphrase_events(result):
+                    request.events.put(event)
+        elif first.events is not None:
+            events = self._iter_events(first)
+            try:
+                for event in events:
+                    if first.cancelled:
+                        # The client went away; don't finish its work
+                        break
+                    first.events.put(event)
+            finally:
+                events.close()
+        elif first.kind == "paragraph":
+            first.result = self.paraphraser.paraphrase_paragraph(
+                first.text, num_paraphrases=first.num_paraphrases, seed=first.seed, **first.params
+            )
+        else:
+            first.result = self.paraphraser.paraphrase(
+                first.text, num_paraphrases=first.num_paraphrases, seed=first.seed, **first.params
+            )
+
+    def _iter_events(self, request: _Request) -> Iterator[Dict[str, Any]]:
+        """Run a streaming request on the engine, yielding its events."""
+        options = dict(num_paraphrases=request.num_paraphrases, seed=request.seed, **request.params)
+        if request.kind == "stream_many":
+            found: Dict[int, List[str]] = {}
+            events = self.paraphraser.iter_paraphrase_many(request.text, **options)
+            for index, new, finished in events:
+                found.setdefault(index, []).extend(new)
+                if finished:
+                    yield {"index": index, "paraphrases": found.pop(index)}
+        elif request.kind == "stream_paragraph":
+            yield from self.paraphraser.iter_paraphrase_paragraph(request.text, **options)
+        else:
+            yield from self.paraphraser.iter_paraphrase(request.text, **options)
+
+    def _record(self, batch: List[_Request], started: float, finished: float) -> None:
+        wait = started - min(request.enqueued_at for request in batch)
+        with self._cond:
+            self.batches += 1
+            self.batched_requests += len(batch)
+            self.total_wait += wait
+            self.total_run += finished - started
+            self.recent.append({
+                "size": len(batch),
+                "tokens": sum(request.tokens or 0 for request in batch),
+                "kind": batch[0].kind,
+                "wait_ms": round(wait * 1000, 1),
+                "run_ms": round((finished - started) * 1000, 1),
+            })
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, batch counters and the most recent batches."""
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "max_batch_tokens": self.max_batch_tokens,
+                "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout,
+                "queue_depth": len(self._queue),
+                "oldest_wait_ms": (
+                    round((now - self._queue[0].enqueued_at) * 1000, 1) if self._queue else 0.0
+                ),
+                "saturated": self.saturated(),
+                "requests": self.requests,
+                "cached": self.cached,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "batches": self.batches,
+                "mean_batch_size": self.batched_requests / self.batches if self.batches else 0.0,
+                "mean_wait_ms": self.total_wait * 1000 / self.batches if self.batches else 0.0,
+                "mean_run_ms": self.total_run * 1000 / self.batches if self.batches else 0.0,
+                "recent_batches": list(self.recent)[-10:],
+            }
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Pre-fork server for the paraphraser web apps
+
+The master process loads the model once, freezes the garbage collector and
+forks the workers, so every worker shares the weight pages copy-on-write
+instead of loading its own copy. Workers accept connections on one shared
+listening socket, each with its own thread count (and optionally its own
+block of cores). Workers that die are restarted.
+
+Usage: python serve.py [--workers 4] [--threads 2] [--pin] [--port 8080] [--app app]
+                       [--metrics-port 9100]
+"""
+
+import argparse
+import gc
+import importlib
+import os
+import signal
+import socket
+import sys
+import time
+
+from cpu_layout import (
+    available_cpus, configure_threads, format_cpu_list, parse_cpu_list, plan_layout
+)
+from serving import serve_metrics
+
+
+# A worker that dies sooner than this after starting is restarted with a delay,
+# so a crashing worker doesn't turn into a fork loop
+MIN_WORKER_LIFETIME = 5.0
+
+
+def run_worker(
+    index, listener, server_module, host, port, num_threads, interop_threads, cpus,
+    metrics_port=None,
+):
+    """Serve requests in a forked worker until it is terminated."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    threads = configure_threads(num_threads, interop_threads, cpus)
+
+    paraphraser = server_module.paraphraser
+    if paraphraser.backend == 'onnx':
+        # ONNX Runtime sessions don't survive a fork; the export is cached on
+        # disk, so loading it again per worker is cheap
+        server_module.init_paraphraser(
+            apply_threads=False, share_model=False, num_threads=threads['num_threads']
+        )
+
+    # Background job workers are threads, so they start after the fork
+    jobs = getattr(server_module, 'jobs', None)
+    if jobs is not None:
+        jobs.start()
+
+    if metrics_port is not None:
+        # Scrapes of the shared port reach a random worker; this one is ours alone
+        serve_metrics(host, metrics_port + index, server_module)
+
+    from werkzeug.serving import make_server
+    server = make_server(host, port, server_module.app, threaded=True, fd=listener.fileno())
+    print(
+        f"Worker {index} (pid {os.getpid()}): {threads['num_threads']} threads "
+        f"on CPUs {format_cpu_list(threads['cpus'])}"
+    )
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pre-fork multi-worker server for the AI Paraphraser',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python serve.py --workers 4
+  python serve.py --workers 2 --threads 4 --pin
+  python serve.py --app web_api --port 5000
+  python serve.py --workers 4 --metrics-port 9100   # metrics on 9100-9103
+
+The model is configured with the PARAPHRASER_* environment variables used by
+app.py and web_api.py (see serving.py).
+        """
+    )
+    parser.add_argument('-w', '--workers', type=int, default=2,
+                        help='Number of worker processes (default: 2)')
+    parser.add_argument('-t', '--threads', type=int,
+                        help='Threads per worker (default: CPUs / workers)')
+    parser.add_argument('--interop-threads', type=int, default=1,
+                        help='Inter-op threads per worker (default: 1)')
+    parser.add_argument('--pin', action='store_true',
+                        help='Pin each worker to its own block of CPUs')
+    parser.add_argument('--cpus', help='CPUs to use, e.g. 0-7 (default: all available)')
+    parser.add_argument('--app', choices=['app', 'web_api'], default='app',
+                        help='Server to run (default: app)')
+    parser.add_argument('--host', default='0.0.0.0', help='Address to listen on (default: 0.0.0.0)')
+    parser.add_argument('-p', '--port', type=int, default=int(os.environ.get('PORT', 8080)),
+                        help='Port to listen on (default: 8080, env: PORT)')
+    parser.add_argument('--metrics-port', type=int,
+                        default=int(os.environ.get('PARAPHRASER_METRICS_PORT') or 0) or None,
+                        help='Serve worker N\'s /metrics on this port + N, so each worker '
+                             'can be scraped on its own (env: PARAPHRASER_METRICS_PORT)')
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    cpus = parse_cpu_list(args.cpus) if args.cpus else available_cpus()
+    threads = args.threads or max(len(cpus) // args.workers, 1)
+    if args.pin:
+        try:
+            layout = plan_layout(args.workers, threads, cpus)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        layout = [None] * args.workers
+
+    # Bind before loading so a busy port fails fast
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(128)
+    listener.set_inheritable(True)
+
+    server_module = importlib.import_module(args.app)
+    server_module.init_paraphraser(apply_threads=False)
+
+    # Move everything allocated so far out of the collector's generations so
+    # collections in the workers don't write to (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+
+    workers = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(
+                    index, listener, server_module, args.host, args.port,
+                    threads, args.interop_threads, layout[index], args.metrics_port,
+                )
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = (index, time.monotonic())
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(args.workers):
+        spawn(index)
+
+    print("\n" + "=" * 70)
+    print(f"🌐 AI Paraphraser ({args.app}) with {args.workers} workers x {threads} threads")
+    print("=" * 70)
+    print(f"\n✓ Server running at: http://localhost:{args.port}")
+    if args.metrics_port is not None:
+        last = args.metrics_port + args.workers - 1
+        print(f"✓ Worker metrics on ports {args.metrics_port}-{last} (/metrics)")
+    print("\nPress Ctrl+C to stop the server")
+    print("=" * 70 + "\n")
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = workers.pop(pid, (None, None))
+        if index is None or stopping:
+            continue
+
+        code = os.waitstatus_to_exitcode(status)
+        print(f"Worker {index} (pid {pid}) exited with status {code}, restarting")
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            time.sleep(MIN_WORKER_LIFETIME)
+        if not stopping:
+            spawn(index)
+
+    listener.close()
+    print("Server stopped")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
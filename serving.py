@@ -0,0 +1,201 @@
+"""
+Helpers shared by the web servers (app.py, web_api.py and serve.py)
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+from cache import DiskResultCache
+from cpu_layout import settings_from_env
+
+
+def env_flag(name: str) -> bool:
+    """True when environment variable `name` is set to anything but '' or '0'."""
+    return os.environ.get(name, '') not in ('', '0')
+
+
+def paraphraser_from_env(model_name: Optional[str] = None, apply_threads: bool = True, **options):
+    """
+    Create the AIParaphraser configured by the PARAPHRASER_* environment.
+
+    PARAPHRASER_MODEL     model to serve instead of the server's default
+    PARAPHRASER_CACHE     file path of a result cache shared across workers/restarts
+    PARAPHRASER_QUANTIZE  'int8-dynamic' to serve a quantized model on the CPU
+    PARAPHRASER_BACKEND   'onnx' to generate with ONNX Runtime on the CPU
+    PARAPHRASER_COMPILE   '1' to compile the model and warm it up before serving
+    PARAPHRASER_THREADS / PARAPHRASER_INTEROP_THREADS / PARAPHRASER_CPUS (or
+    PARAPHRASER_INSTANCES with PARAPHRASER_INSTANCE) pack workers onto cores,
+    see cpu_layout.py
+
+    Args:
+        model_name: The server's default model (None: AIParaphraser's default)
+        apply_threads: Apply the thread/affinity settings to this process
+                       (the pre-fork master leaves that to each worker)
+        **options: Extra AIParaphraser arguments, overriding the environment
+    """
+    from metrics import engine_metrics
+    from paraphraser import AIParaphraser
+
+    cache_path = os.environ.get('PARAPHRASER_CACHE')
+    quantize = os.environ.get('PARAPHRASER_QUANTIZE') or None
+    backend = os.environ.get('PARAPHRASER_BACKEND') or 'torch'
+
+    kwargs = dict(
+        result_store=DiskResultCache(cache_path) if cache_path else None,
+        quantize=quantize,
+        backend=backend,
+        device='cpu' if quantize or backend == 'onnx' else None,
+        compile=env_flag('PARAPHRASER_COMPILE'),
+        metrics=engine_metrics,
+    )
+    model_name = os.environ.get('PARAPHRASER_MODEL') or model_name
+    if model_name:
+        kwargs['model_name'] = model_name
+    if apply_threads:
+        kwargs.update(settings_from_env())
+    kwargs.update(options)
+    return AIParaphraser(**kwargs)
+
+
+def scheduler_from_env(paraphraser):
+    """
+    Create the BatchScheduler that coalesces concurrent requests for `paraphraser`.
+
+    PARAPHRASER_MAX_BATCH         requests per batch (default 8, 1 disables batching)
+    PARAPHRASER_MAX_WAIT_MS       how long to hold a request for others to join (default 10)
+    PARAPHRASER_MAX_BATCH_TOKENS  optional cap on the input tokens of a batch
+    PARAPHRASER_MAX_QUEUE         waiting requests before new ones get a 503
+                                  (default 64, 0: unbounded)
+    PARAPHRASER_QUEUE_TIMEOUT     seconds a request may wait to start
+                                  (default 30, 0: no limit)
+    """
+    from scheduler import BatchScheduler
+
+    max_batch_tokens = os.environ.get('PARAPHRASER_MAX_BATCH_TOKENS')
+    max_queue = int(os.environ.get('PARAPHRASER_MAX_QUEUE') or 64)
+    queue_timeout = float(os.environ.get('PARAPHRASER_QUEUE_TIMEOUT') or 30)
+    return BatchScheduler(
+        paraphraser,
+        max_batch=int(os.environ.get('PARAPHRASER_MAX_BATCH') or 8),
+        max_wait=float(os.environ.get('PARAPHRASER_MAX_WAIT_MS') or 10) / 1000,
+        max_batch_tokens=int(max_batch_tokens) if max_batch_tokens else None,
+        max_queue=max_queue or None,
+        queue_timeout=queue_timeout or None,
+    )
+
+
+def overloaded_response(error):
+    """JSON 503 response telling the client when to retry (for scheduler.Overloaded)."""
+    from flask import jsonify
+
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def jobs_from_env(scheduler):
+    """
+    Create the JobRunner that runs long documents in the background.
+
+    PARAPHRASER_JOBS_DB       SQLite file jobs are kept in
+                              (default ~/.cache/paraphraser/jobs.sqlite3)
+    PARAPHRASER_JOB_WORKERS   worker threads per process (default 1)
+    PARAPHRASER_MAX_JOBS      queued jobs before new ones get a 503
+                              (default 1000, 0: unbounded)
+    PARAPHRASER_JOB_LEASE     seconds a running job may go without a
+                              heartbeat before it is queued again (default 60)
+    """
+    from jobs import DEFAULT_JOBS_PATH, JobRunner, JobStore
+
+    max_jobs = int(os.environ.get('PARAPHRASER_MAX_JOBS') or 1000)
+    return JobRunner(
+        JobStore(os.environ.get('PARAPHRASER_JOBS_DB') or DEFAULT_JOBS_PATH),
+        scheduler,
+        workers=int(os.environ.get('PARAPHRASER_JOB_WORKERS') or 1),
+        max_queued=max_jobs or None,
+        lease=float(os.environ.get('PARAPHRASER_JOB_LEASE') or 60),
+    )
+
+
+def instrument(app):
+    """Count and time every request to the Flask `app` in the server metrics."""
+    from flask import g, request
+    from metrics import server_metrics
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            # The route pattern, not the path, so job ids don't create new series
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            server_metrics.observe_request(
+                endpoint, request.method, response.status_code, time.perf_counter() - started
+            )
+        return response
+
+    return app
+
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def metrics_text(paraphraser=None, scheduler=None, jobs=None) -> str:
+    """
+    This process's metrics in the Prometheus text format.
+
+    Every series carries a `worker` label with the process id, so series from
+    different serve.py workers never merge into one.
+    """
+    from metrics import registry, server_metrics
+
+    if paraphraser is not None:
+        server_metrics.collect(paraphraser, scheduler, jobs)
+    return registry.render(worker=os.getpid())
+
+
+def metrics_response(paraphraser=None, scheduler=None, jobs=None):
+    """Flask response with this process's metrics (see `metrics_text`)."""
+    from flask import Response
+
+    return Response(
+        metrics_text(paraphraser, scheduler, jobs), content_type=METRICS_CONTENT_TYPE
+    )
+
+
+def metrics_app(server_module):
+    """
+    WSGI app serving only `/metrics` for the server in `server_module`.
+
+    serve.py workers share one port, so a scrape of the server's own /metrics
+    reaches a random worker. With `--metrics-port` each worker also runs this
+    app on a port of its own, giving Prometheus one target per worker.
+    """
+    def app(environ, start_response):
+        if environ.get('PATH_INFO') != '/metrics':
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not found\n']
+        body = metrics_text(
+            server_module.paraphraser,
+            server_module.scheduler,
+            getattr(server_module, 'jobs', None),
+        )
+        start_response('200 OK', [('Content-Type', METRICS_CONTENT_TYPE)])
+        return [body.encode('utf-8')]
+
+    return app
+
+
+def serve_metrics(host: str, port: int, server_module):
+    """Serve `metrics_app(server_module)` on `port` from a background thread."""
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, metrics_app(server_module), threaded=True)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -0,0 +1,109 @@
+"""
+Unit tests for the in-memory and SQLite result caches
+"""
+
+import time
+
+from cache import DiskResultCache, LRUCache, ResultCache
+
+
+def test_lru_evicts_least_recently_used_over_budget():
+    cache = LRUCache(max_bytes=30)
+    cache.put("a", 1, 10)
+    cache.put("b", 2, 10)
+    cache.put("c", 3, 10)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+
+    cache.put("d", 4, 10)
+
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == [1, 3, 4]
+    assert cache.stats()["bytes"] == 30
+    assert cache.evictions == 1
+
+
+def test_lru_respects_max_entries_and_ttl():
+    cache = LRUCache(max_bytes=1000, max_entries=2, ttl=0.05)
+    for key in "abc":
+        cache.put(key, key, 1)
+    assert len(cache) == 2
+    assert cache.get("a") is None
+
+    time.sleep(0.06)
+    assert cache.get("c") is None
+    assert cache.stats()["bytes"] == 1
+
+
+def test_disabled_lru_stores_nothing():
+    cache = LRUCache(max_bytes=0)
+    cache.put("a", 1, 1)
+    assert cache.get("a") is None
+
+
+def test_result_cache_keys_normalize_whitespace():
+    cache = ResultCache()
+    key = ResultCache.make_key("paraphrase", "model", "Some  text\n", {"top_k": 50}, 1)
+    cache.put_result(key, ["one", "two"])
+
+    same = ResultCache.make_key("paraphrase", "model", "Some text", {"top_k": 50}, 1)
+    other_seed = ResultCache.make_key("paraphrase", "model", "Some text", {"top_k": 50}, 2)
+    assert cache.get_result(same) == ["one", "two"]
+    assert cache.get_result(other_seed) is None
+
+
+def test_disk_cache_round_trip_and_shared_file(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+    key = ("paraphrase", "model", "text", (("top_k", 50),), 1)
+    DiskResultCache(path).put_result(key, ["a", "b"])
+
+    # A second instance (another process in practice) sees the same rows
+    other = DiskResultCache(path)
+    assert other.get_result(key) == ["a", "b"]
+    assert other.get_result(key[:-1] + (2,)) is None
+    assert (other.hits, other.misses) == (1, 1)
+
+
+def test_disk_cache_keeps_a_running_size_total(tmp_path):
+    cache = DiskResultCache(str(tmp_path / "results.sqlite3"))
+    cache.put_result(("a",), ["x" * 100])
+    cache.put_result(("b",), ["y" * 50])
+    cache.put_result(("a",), ["z" * 10])  # replacing a key adjusts the total
+
+    conn = cache._connection()
+    actual = conn.execute("SELECT SUM(size) FROM results").fetchone()[0]
+    assert cache.stats()["bytes"] == actual
+
+    cache.clear()
+    assert cache.stats()["bytes"] == 0
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskResultCache(str(tmp_path / "results.sqlite3"), max_mb=300 / (1024 * 1024))
+    for index in range(5):
+        cache.put_result((index,), ["x" * 90])
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 300
+    assert stats["evictions"] == 2
+    assert cache.get_result((0,)) is None
+    assert cache.get_result((4,)) is not None
+
+
+def test_disk_cache_seeds_total_for_existing_databases(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+    cache = DiskResultCache(path)
+    cache.put_result(("a",), ["x" * 100])
+    conn = cache._connection()
+    with conn:
+        conn.execute("DROP TABLE results_usage")
+
+    assert DiskResultCache(path).stats()["bytes"] == cache.stats()["bytes"] > 0
+
+
+def test_disk_cache_expires_rows(tmp_path):
+    cache = DiskResultCache(str(tmp_path / "results.sqlite3"), ttl=0.05)
+    cache.put_result(("a",), ["x"])
+    time.sleep(0.06)
+
+    assert cache.get_result(("a",)) is None
+    assert cache.stats()["entries"] == 0
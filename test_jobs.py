@@ -0,0 +1,173 @@
+"""
+Unit tests for the background job store and runner (no model needed)
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from jobs import JobRunner, JobStore
+from paraphraser import AIParaphraser
+from scheduler import BatchScheduler
+
+
+class FakeParaphraser:
+    """Paraphrases each sentence as '<sentence> a' / '<sentence> b'."""
+
+    tokenizer = None
+    split_sentences = AIParaphraser.split_sentences
+    variations_per_sentence = staticmethod(AIParaphraser.variations_per_sentence)
+    combine_sentences = staticmethod(AIParaphraser.combine_sentences)
+
+    def __init__(self):
+        self.requests = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def iter_paraphrase_many(self, texts, num_paraphrases=5, seed=None, **params):
+        self.requests.append(list(texts))
+        for index, text in enumerate(texts):
+            if "fails" in text:
+                raise RuntimeError("generation failed")
+            yield index, [f"{text} a", f"{text} b"], True
+
+    def iter_paraphrase_paragraph(self, text, num_paraphrases=5, seed=None, **params):
+        self.requests.append([text])
+        self.release.wait()
+        yield {"type": "paraphrase", "index": 0, "text": f"{text} a"}
+
+
+def wait_for(runner, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = runner.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} did not finish: {job}")
+
+
+def test_claim_is_oldest_first_and_exclusive(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    first = store.submit("first", {})
+    second = store.submit("second", {})
+
+    assert store.position(second) == 1
+    claimed = store.claim("host:1")
+    assert claimed["id"] == first and claimed["text"] == "first"
+    assert claimed["status"] == "running"
+    assert store.claim("host:2")["id"] == second
+    assert store.claim("host:3") is None
+    assert store.counts()["running"] == 2
+
+
+def test_finish_fail_and_purge(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    done = store.submit("done", {})
+    failed = store.submit("failed", {})
+    store.progress(done, 1, 2)
+    store.finish(done, ["result"])
+    store.fail(failed, "boom")
+
+    job = store.get(done)
+    assert (job["status"], job["result"], job["done"], job["total"]) == ("done", ["result"], 2, 2)
+    assert store.get(failed)["error"] == "boom"
+    assert "text" not in job
+
+    assert store.purge(older_than=3600) == 0
+    assert store.purge(older_than=-1) == 2
+    assert store.get(done) is None
+
+
+def test_jobs_with_expired_leases_are_requeued(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    orphan = store.submit("orphan", {})
+    alive = store.submit("alive", {})
+    # Same host and pid: only the lease tells the runners apart
+    store.claim(f"{socket.gethostname()}:{os.getpid()}:dead")
+    store.claim(f"{socket.gethostname()}:{os.getpid()}:live")
+    time.sleep(0.1)
+    store.heartbeat(f"{socket.gethostname()}:{os.getpid()}:live")
+
+    assert store.requeue_orphans(lease=0.05) == 1
+    job = store.get(orphan)
+    assert (job["status"], job["worker"], job["heartbeat_at"]) == ("queued", None, None)
+    assert store.get(alive)["status"] == "running"
+
+
+def test_runner_renews_its_leases_and_takes_over_abandoned_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    abandoned = store.submit("Left behind by a runner that was restarted.", {
+        "num_paraphrases": 1, "seed": None,
+    })
+    store.claim("host:1:previous")
+    engine = FakeParaphraser()
+    runner = JobRunner(store, BatchScheduler(engine), lease=0.3)
+    runner.start()
+
+    assert wait_for(runner, abandoned)["status"] == "done"
+    assert store.get(abandoned)["worker"] == runner.runner_id
+
+    # A job that outlives the lease keeps it renewed
+    engine.release.clear()
+    long_running = runner.submit("Still running after the lease.", num_paraphrases=1)
+    time.sleep(0.8)
+    assert store.requeue_orphans(lease=0.3) == 0
+    assert store.get(long_running)["status"] == "running"
+    engine.release.set()
+    assert wait_for(runner, long_running)["status"] == "done"
+
+
+def test_runner_streams_sentences_as_separate_requests(tmp_path):
+    engine = FakeParaphraser()
+    scheduler = BatchScheduler(engine, max_batch=2)
+    runner = JobRunner(JobStore(str(tmp_path / "jobs.sqlite3")), scheduler)
+    text = " ".join(f"This is sentence number {i}." for i in range(5))
+
+    job = wait_for(runner, runner.submit(text, num_paraphrases=2))
+
+    assert job["status"] == "done"
+    assert (job["done"], job["total"]) == (5, 5)
+    assert len(job["result"]) == 2
+    assert all(paragraph.count("This is sentence") == 5 for paragraph in job["result"])
+    assert [len(texts) for texts in engine.requests] == [2, 2, 1]
+
+
+def test_a_failing_sentence_fails_the_job(tmp_path):
+    engine = FakeParaphraser()
+    scheduler = BatchScheduler(engine, max_batch=1)
+    runner = JobRunner(JobStore(str(tmp_path / "jobs.sqlite3")), scheduler)
+    # The shortest sentence runs first
+    text = "The first sentence is fine. It fails here. The third sentence is never run."
+
+    job = wait_for(runner, runner.submit(text, num_paraphrases=2))
+
+    assert (job["status"], job["error"]) == ("failed", "generation failed")
+    assert engine.requests == [["It fails here."]]
+
+
+def test_runner_survives_store_errors(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    runner = JobRunner(store, BatchScheduler(FakeParaphraser()))
+    runner.POLL_INTERVAL = 0.05
+    finish = store.finish
+    failures = []
+
+    def locked_finish(*args):
+        if len(failures) < 2:
+            failures.append(args[0])
+            raise sqlite3.OperationalError("database is locked")
+        finish(*args)
+
+    store.finish = locked_finish
+    job = wait_for(runner, runner.submit("Just a single short sentence.", num_paraphrases=1))
+
+    assert job["status"] == "done"
+    assert job["result"] == ["Just a single short sentence. a"]
+    assert len(failures) == 2
+
+    # The worker thread is still alive and takes the next job
+    store.finish = finish
+    assert wait_for(runner, runner.submit("Another short sentence here."))["status"] == "done"
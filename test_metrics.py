@@ -0,0 +1,82 @@
+"""
+Unit tests for the Prometheus metrics rendering
+"""
+
+import pytest
+
+from metrics import MetricsRegistry
+from serving import METRICS_CONTENT_TYPE, metrics_app
+
+
+def test_counter_and_gauge_render():
+    registry = MetricsRegistry()
+    calls = registry.counter("calls_total", "Calls", ("model",))
+    depth = registry.gauge("queue_depth", "Waiting requests")
+    calls.inc(model="t5")
+    calls.inc(2, model="t5")
+    calls.inc(model='quote"d')
+    depth.set(0.5)
+
+    lines = registry.render().splitlines()
+
+    assert lines[:2] == ["# HELP calls_total Calls", "# TYPE calls_total counter"]
+    assert 'calls_total{model="t5"} 3' in lines
+    assert 'calls_total{model="quote\\"d"} 1' in lines
+    assert "queue_depth 0.5" in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    seconds = registry.histogram("stage_seconds", "Stage time", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        seconds.observe(value, stage="generate")
+
+    lines = registry.render().splitlines()
+
+    assert 'stage_seconds_bucket{stage="generate",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="generate",le="1"} 2' in lines
+    assert 'stage_seconds_bucket{stage="generate",le="+Inf"} 3' in lines
+    assert 'stage_seconds_sum{stage="generate"} 5.55' in lines
+    assert 'stage_seconds_count{stage="generate"} 3' in lines
+
+
+def test_constant_labels_go_on_every_series():
+    registry = MetricsRegistry()
+    registry.counter("calls_total", "Calls", ("model",)).inc(model="t5")
+    registry.histogram("seconds", "Time", buckets=(1.0,)).observe(0.5)
+
+    lines = registry.render(worker=123).splitlines()
+
+    assert 'calls_total{model="t5",worker="123"} 1' in lines
+    assert 'seconds_bucket{worker="123",le="1"} 1' in lines
+    assert 'seconds_count{worker="123"} 1' in lines
+
+
+def test_registering_twice_returns_the_same_metric():
+    registry = MetricsRegistry()
+    counter = registry.counter("calls_total", "Calls", ("model",))
+
+    assert registry.counter("calls_total", "Calls", ("model",)) is counter
+    with pytest.raises(ValueError):
+        registry.gauge("calls_total", "Calls", ("model",))
+    with pytest.raises(ValueError):
+        counter.inc(mode="paraphrase")
+
+
+def test_metrics_app_serves_only_metrics():
+    class Server:
+        paraphraser = None
+        scheduler = None
+
+    app = metrics_app(Server)
+    statuses = []
+
+    def start_response(status, headers):
+        statuses.append((status, dict(headers)))
+
+    body = b"".join(app({"PATH_INFO": "/metrics"}, start_response)).decode()
+    assert statuses[-1] == ("200 OK", {"Content-Type": METRICS_CONTENT_TYPE})
+    assert "# TYPE paraphraser_engine_calls_total counter" in body
+
+    app({"PATH_INFO": "/api/paraphrase"}, start_response)
+    assert statuses[-1][0] == "404 Not Found"
@@ -0,0 +1,31 @@
+"""
+Unit tests for identifying model revisions (no hub access or ONNX Runtime needed)
+"""
+
+import os
+
+from onnx_backend import export_dir, model_revision
+
+
+COMMIT = "0123456789abcdef0123456789abcdef01234567"
+
+
+def test_commit_hashes_are_used_as_is():
+    assert model_revision("org/model", COMMIT) == COMMIT
+    assert export_dir("org/model", COMMIT, "/cache") == os.path.join(
+        "/cache", "org--model", COMMIT
+    )
+
+
+def test_local_directories_are_fingerprinted_by_their_weights(tmp_path):
+    model_dir = tmp_path / "model"
+    model_dir.mkdir()
+    (model_dir / "config.json").write_text("{}")
+    (model_dir / "model.safetensors").write_bytes(b"weights")
+    before = model_revision(str(model_dir))
+
+    assert model_revision(str(model_dir), "some-branch") == before
+    assert os.path.basename(export_dir(str(model_dir), cache_dir=str(tmp_path))) == before
+
+    (model_dir / "model.safetensors").write_bytes(b"new weights")
+    assert model_revision(str(model_dir)) != before
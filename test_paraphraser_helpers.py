@@ -0,0 +1,162 @@
+"""
+Unit tests for AIParaphraser's model-free helpers and the row sampling processor
+"""
+
+import threading
+
+import pytest
+
+from cache import ResultCache
+from paraphraser import AIParaphraser
+
+
+def bare_paraphraser():
+    """An AIParaphraser without a loaded model, for the pure-Python parts."""
+    paraphraser = AIParaphraser.__new__(AIParaphraser)
+    paraphraser._calls = threading.local()
+    paraphraser.metrics = None
+    paraphraser.tracer = None
+    paraphraser.adaptive = False
+    paraphraser.model_name = "fake-model"
+    paraphraser.model_id = "fake-model"
+    paraphraser.decoding_strategy = "beam_sample"
+    paraphraser.length_ratio = 1.5
+    paraphraser.length_slack = 16
+    paraphraser.result_cache = ResultCache()
+    paraphraser.result_store = None
+    return paraphraser
+
+
+def fake_iter_paraphrase_many(requests):
+    """An iter_paraphrase_many stand-in that records each request's texts."""
+
+    def iter_paraphrase_many(texts, num_paraphrases=5, seed=None, **params):
+        requests.append(list(texts))
+        for index, text in enumerate(texts):
+            yield index, [f"{text} ({i})" for i in range(num_paraphrases)], True
+
+    return iter_paraphrase_many
+
+
+def test_make_batches_groups_by_length_within_limits():
+    lengths = [5, 1, 9, 3, 7]
+
+    assert AIParaphraser._make_batches(lengths, batch_size=2) == [[1, 3], [0, 4], [2]]
+    # 3 x 7 tokens would exceed 14, so the third text starts a new batch
+    assert AIParaphraser._make_batches(lengths, batch_size=8, max_batch_tokens=14) == [
+        [1, 3], [0, 4], [2]
+    ]
+    assert AIParaphraser._make_batches(lengths, batch_size=8) == [[1, 3, 0, 4, 2]]
+
+
+def test_make_batches_keeps_oversized_texts():
+    assert AIParaphraser._make_batches([50, 2], batch_size=8, max_batch_tokens=10) == [[1], [0]]
+
+
+def test_diverse_beam_without_a_penalty_is_plain_beam_search():
+    kwargs = AIParaphraser._strategy_kwargs("diverse_beam", 4, 5, diversity_penalty=1.0)
+    assert (kwargs["num_beam_groups"], kwargs["diversity_penalty"]) == (4, 1.0)
+
+    kwargs = AIParaphraser._strategy_kwargs("diverse_beam", 4, 5, diversity_penalty=0.0)
+    assert (kwargs["num_beams"], kwargs["num_beam_groups"]) == (4, 1)
+    assert kwargs["diversity_penalty"] == 0.0
+
+    with pytest.raises(ValueError, match="diversity_penalty"):
+        AIParaphraser._strategy_kwargs("diverse_beam", 4, 5, diversity_penalty=-1.0)
+
+
+def test_collect_paraphrases_drops_copies_and_duplicates():
+    paraphrases = []
+    seen = set()
+    AIParaphraser._collect_paraphrases(
+        "The cat sat.",
+        ["A cat sat.", "the cat sat.", "", "  ", "A  cat sat.", "The cat was sitting."],
+        paraphrases,
+        seen,
+    )
+
+    assert paraphrases == ["A cat sat.", "The cat was sitting."]
+
+
+def test_split_and_combine_sentences():
+    paraphraser = bare_paraphraser()
+    sentences = paraphraser.split_sentences(
+        "The first sentence is here. Short. The second one; and a clause after it!"
+    )
+    assert sentences == ["The first sentence is here.", "The second one", "and a clause after it!"]
+
+    variations = [["A1", "A2"], ["B1", "B2"], ["C1"]]
+    paragraphs = AIParaphraser.combine_sentences(variations, 3, seed=1)
+    assert len(paragraphs) == len(set(paragraphs)) == 3
+    assert paragraphs == AIParaphraser.combine_sentences(variations, 3, seed=1)
+
+
+def test_seeded_calls_ignore_the_uniqueness_history():
+    paraphraser = bare_paraphraser()
+    AIParaphraser._uniqueness_rates["fake-model"] = 0.1
+    try:
+        assert paraphraser._uniqueness_rate(seed=3) == AIParaphraser.DEFAULT_UNIQUENESS_RATE
+        assert paraphraser._uniqueness_rate(seed=None) == 0.1
+        assert paraphraser._round_size_for(5, 0.5) == 12
+    finally:
+        del AIParaphraser._uniqueness_rates["fake-model"]
+
+
+def test_first_alone_runs_the_first_sentence_on_its_own():
+    paraphraser = bare_paraphraser()
+    requests = []
+    paraphraser.iter_paraphrase_many = fake_iter_paraphrase_many(requests)
+    text = "The first sentence is here. The second sentence follows. A third one ends it."
+
+    events = list(paraphraser.iter_paraphrase_paragraph(text, 2, first_alone=True))
+
+    assert requests == [
+        ["The first sentence is here."],
+        ["The second sentence follows.", "A third one ends it."],
+    ]
+    sentences = [event for event in events if event["type"] == "sentence"]
+    assert [event["index"] for event in sentences] == [0, 1, 2]
+    assert sum(event["type"] == "paraphrase" for event in events) == 2
+
+
+def test_cached_result_matches_the_generating_call():
+    paraphraser = bare_paraphraser()
+    requests = []
+    paraphraser.iter_paraphrase_many = fake_iter_paraphrase_many(requests)
+    paragraph = "The first sentence is here. The second sentence follows."
+
+    result = paraphraser.paraphrase("Some text.", 2, seed=3, temperature=1.0)
+    paragraphs = paraphraser.paraphrase_paragraph(paragraph, 2, seed=3, first_alone=True)
+    generated = len(requests)
+
+    cached = paraphraser.cached_result("paraphrase", "Some text.", 2, seed=3, temperature=1.0)
+    assert cached == result
+    assert paraphraser.cached_result("paraphrase", "Some text.", 2, seed=3) is None
+    assert paraphraser.cached_result("paraphrase", "Some text.", 2, temperature=1.0) is None
+    assert paraphraser.cached_result(
+        "paragraph", paragraph, 2, seed=3, first_alone=True
+    ) == paragraphs
+    assert paraphraser.cached_result("paragraph", paragraph, 2, seed=3) is None
+    assert len(requests) == generated
+
+
+def test_row_sampling_applies_per_row_settings():
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from sampling import RowSamplingLogitsProcessor
+
+    # Two inputs with two rows (beams) each
+    scores = torch.tensor([[4.0, 3.0, 2.0, 1.0]] * 4)
+    processor = RowSamplingLogitsProcessor(
+        temperatures=[2.0, 1.0], top_ks=[1, 0], top_ps=[1.0, 0.7]
+    )
+
+    result = processor(torch.zeros(4, 1, dtype=torch.long), scores)
+
+    # First input: temperature 2, only the best token kept
+    assert result[0, 0] == 2.0 and torch.isinf(result[0, 1:]).all()
+    assert torch.equal(result[0], result[1])
+    # Second input: no top-k, top-p 0.7 keeps the tokens up to the one crossing it
+    assert result[2, :2].tolist() == [4.0, 3.0]
+    assert torch.isinf(result[2, 2:]).all()
+    assert torch.equal(result[2], result[3])
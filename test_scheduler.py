@@ -0,0 +1,348 @@
+"""
+Unit tests for the micro-batching scheduler (no model needed)
+"""
+
+import threading
+import time
+
+import pytest
+
+from scheduler import BatchScheduler, QueueFull, QueueTimeout
+
+
+class FakeTokenizer:
+    """Counts whitespace-separated words as tokens."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return {"input_ids": text.split()}
+
+
+class FakeParaphraser:
+    """Stands in for AIParaphraser, recording the calls the scheduler makes."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.tokenizer = FakeTokenizer()
+        self.calls = []
+        # Cached results by (mode, text, seed)
+        self.results = {}
+        self.release = threading.Event()
+        self.release.set()
+
+    def cached_result(self, mode, text, num_paraphrases=5, seed=None, **params):
+        return self.results.get((mode, text, seed))
+
+    def _run(self, kind, texts):
+        self.calls.append((kind, texts))
+        self.release.wait()
+        time.sleep(self.delay)
+
+    def paraphrase(self, text, num_paraphrases=5, seed=None, **params):
+        self._run("paraphrase", [text])
+        return [f"{text} ({seed})"]
+
+    def paraphrase_paragraph(self, text, num_paraphrases=5, seed=None, **params):
+        self._run("paragraph", [text])
+        return [text.upper()]
+
+    def paraphrase_many(self, texts, num_paraphrases=5, **params):
+        self._run("many", list(texts))
+        return [[text.upper()] for text in texts]
+
+    def iter_paraphrase(self, text, num_paraphrases=5, seed=None, **params):
+        self._run("stream", [text])
+        for index in range(num_paraphrases):
+            time.sleep(self.delay)
+            yield {"type": "paraphrase", "index": index, "text": f"{text} {index}"}
+
+    def iter_paraphrase_many(self, texts, num_paraphrases=5, seed=None, **params):
+        self._run("stream_many", list(texts))
+        for index, text in enumerate(texts):
+            if "fail" in text:
+                raise RuntimeError(f"cannot paraphrase {text!r}")
+            yield index, [text.upper()], True
+
+
+def run_concurrently(functions):
+    """Call each function on its own thread and return their results in order."""
+    results = [None] * len(functions)
+
+    def call(position, function):
+        results[position] = function()
+
+    threads = [
+        threading.Thread(target=call, args=(position, function))
+        for position, function in enumerate(functions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_requests_share_a_batch():
+    engine = FakeParaphraser()
+    scheduler = BatchScheduler(engine, max_batch=8, max_wait=0.2)
+    texts = [f"text number {i}" for i in range(5)]
+
+    results = run_concurrently([lambda t=text: scheduler.paraphrase(t, 3) for text in texts])
+
+    assert results == [[text.upper()] for text in texts]
+    assert all(kind == "many" for kind, _ in engine.calls)
+    assert len(engine.calls) < len(texts)
+    assert scheduler.stats()["mean_batch_size"] > 1
+
+
+def test_batches_are_capped_by_max_batch():
+    engine = FakeParaphraser()
+    engine.release.clear()
+    scheduler = BatchScheduler(engine, max_batch=2, max_wait=0.05)
+    # Hold the model thread so the other requests pile up in the queue
+    blocker = threading.Thread(target=scheduler.paraphrase, args=("blocker", 1), kwargs={"seed": 1})
+    blocker.start()
+    time.sleep(0.05)
+
+    waiting = threading.Thread(
+        target=run_concurrently,
+        args=([lambda i=i: scheduler.paraphrase(f"text {i}", 3) for i in range(5)],),
+    )
+    waiting.start()
+    time.sleep(0.1)
+    engine.release.set()
+    waiting.join(5)
+    blocker.join(5)
+
+    sizes = [len(texts) for kind, texts in engine.calls if kind == "many"]
+    assert max(sizes) <= 2
+    assert sum(sizes) == 5
+
+
+def test_max_batch_tokens_splits_batches():
+    engine = FakeParaphraser()
+    engine.release.clear()
+    scheduler = BatchScheduler(engine, max_batch=8, max_wait=0.05, max_batch_tokens=4)
+    blocker = threading.Thread(target=scheduler.paraphrase, args=("blocker", 1), kwargs={"seed": 1})
+    blocker.start()
+    time.sleep(0.05)
+
+    # Three tokens each: two never fit in four tokens
+    texts = [f"three token text{i}" for i in range(3)]
+    waiting = threading.Thread(
+        target=run_concurrently,
+        args=([lambda t=text: scheduler.paraphrase(t, 3) for text in texts],),
+    )
+    waiting.start()
+    time.sleep(0.1)
+    engine.release.set()
+    waiting.join(5)
+    blocker.join(5)
+
+    assert [texts for kind, texts in engine.calls if kind == "many"] == [[t] for t in texts]
+
+
+def test_lone_request_runs_after_max_wait():
+    engine = FakeParaphraser()
+    scheduler = BatchScheduler(engine, max_batch=8, max_wait=0.1)
+
+    started = time.monotonic()
+    assert scheduler.paraphrase("alone here", 3) == ["ALONE HERE"]
+    elapsed = time.monotonic() - started
+
+    assert 0.09 <= elapsed < 2
+
+
+def test_seeded_and_paragraph_requests_run_on_their_own():
+    engine = FakeParaphraser()
+    scheduler = BatchScheduler(engine, max_batch=8, max_wait=0.1)
+
+    results = run_concurrently([
+        lambda: scheduler.paraphrase("seeded text", 3, seed=7),
+        lambda: scheduler.paraphrase_paragraph("a paragraph", 3),
+    ])
+
+    assert results == [["seeded text (7)"], ["A PARAGRAPH"]]
+    assert sorted(kind for kind, _ in engine.calls) == ["paragraph", "paraphrase"]
+
+
+def test_cached_results_skip_the_queue():
+    engine = FakeParaphraser()
+    engine.release.clear()
+    engine.results[("paraphrase", "cached", 1)] = ["from cache"]
+    engine.results[("paragraph", "cached", 1)] = ["paragraph from cache"]
+    scheduler = BatchScheduler(engine, max_batch=1, max_queue=1)
+    blocker = threading.Thread(target=scheduler.paraphrase, args=("blocker", 1), kwargs={"seed": 1})
+    blocker.start()
+    time.sleep(0.05)
+    queued = threading.Thread(target=scheduler.paraphrase, args=("queued", 1), kwargs={"seed": 2})
+    queued.start()
+    time.sleep(0.05)
+
+    # The model is busy and the queue is full, yet cache hits return at once
+    assert scheduler.paraphrase("cached", 1, seed=1) == ["from cache"]
+    assert scheduler.paraphrase_paragraph("cached", 1, seed=1) == ["paragraph from cache"]
+    events = scheduler.stream("cached", 1, seed=1)
+    assert next(events) == {"type": "paraphrase", "index": 0, "text": "from cache"}
+    events.close()
+    with pytest.raises(QueueFull):
+        scheduler.paraphrase("cached", 1, seed=2)
+
+    engine.release.set()
+    blocker.join(5)
+    queued.join(5)
+    assert scheduler.stats()["cached"] == 3
+    assert all(texts != ["cached"] for _, texts in engine.calls)
+
+
+def test_tokenizer_runs_without_the_lock():
+    engine = FakeParaphraser()
+    scheduler = BatchScheduler(engine, max_batch=8, max_wait=0.01)
+    acquired = []
+
+    def probe():
+        if scheduler._cond.acquire(timeout=1):
+            scheduler._cond.release()
+            acquired.append(True)
+        else:
+            acquired.append(False)
+
+    def tokenize(text):
+        # Another thread must be able to take the lock while we tokenize
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+        return {"input_ids": text.split()}
+
+    engine.tokenizer = tokenize
+    assert scheduler.paraphrase("some words", 2) == ["SOME WORDS"]
+    assert acquired and all(acquired)
+
+
+def test_full_queue_rejects_requests():
+    engine = FakeParaphraser()
+    engine.release.clear()
+    scheduler = BatchScheduler(engine, max_batch=1, max_queue=1)
+    blocker = threading.Thread(target=scheduler.paraphrase, args=("blocker", 1), kwargs={"seed": 1})
+    blocker.start()
+    time.sleep(0.05)
+    queued = threading.Thread(target=scheduler.paraphrase, args=("queued", 1), kwargs={"seed": 2})
+    queued.start()
+    time.sleep(0.05)
+
+    with pytest.raises(QueueFull) as error:
+        scheduler.paraphrase("rejected", 1, seed=3)
+    assert error.value.retry_after >= 1
+    assert scheduler.saturated()
+
+    engine.release.set()
+    blocker.join(5)
+    queued.join(5)
+    assert scheduler.stats()["rejected"] == 1
+
+
+def test_requests_time_out_in_the_queue():
+    engine = FakeParaphraser()
+    engine.release.clear()
+    scheduler = BatchScheduler(engine, max_batch=1, queue_timeout=0.1)
+    blocker = threading.Thread(target=scheduler.paraphrase, args=("blocker", 1), kwargs={"seed": 1})
+    blocker.start()
+    time.sleep(0.05)
+
+    with pytest.raises(QueueTimeout):
+        scheduler.paraphrase("too late", 1, seed=2)
+
+    engine.release.set()
+    blocker.join(5)
+    assert scheduler.stats()["timed_out"] == 1
+    assert ("paraphrase", ["too late"]) not in engine.calls
+
+
+def test_closing_a_stream_stops_generation():
+    engine = FakeParaphraser(delay=0.02)
+    scheduler = BatchScheduler(engine)
+
+    events = scheduler.stream("streamed", num_paraphrases=50, seed=3)
+    assert next(events)["index"] == 0
+    events.close()
+
+    # The model thread is free again long before 50 events would take
+    assert scheduler.paraphrase("next", 1, seed=1) == ["next (1)"]
+    assert scheduler.stats()["batches"] == 2
+
+
+def test_unseeded_streams_join_paraphrase_batches():
+    engine = FakeParaphraser()
+    scheduler = BatchScheduler(engine, max_batch=8, max_wait=0.2)
+
+    results = run_concurrently([
+        lambda: list(scheduler.stream("streamed one", 3)),
+        lambda: list(scheduler.stream("streamed two", 3)),
+        lambda: scheduler.paraphrase("plain", 3),
+    ])
+
+    assert results == [
+        [{"type": "paraphrase", "index": 0, "text": "STREAMED ONE"}],
+        [{"type": "paraphrase", "index": 0, "text": "STREAMED TWO"}],
+        ["PLAIN"],
+    ]
+    assert [kind for kind, _ in engine.calls] == ["many"]
+
+
+def test_stream_many_splits_into_max_batch_requests():
+    engine = FakeParaphraser()
+    scheduler = BatchScheduler(engine, max_batch=3)
+    texts = [f"text {'x' * (i % 4)} {i}" for i in range(8)]
+
+    events = list(scheduler.stream_many(texts, num_paraphrases=2))
+
+    assert sorted(event["index"] for event in events) == list(range(8))
+    for event in events:
+        assert event["paraphrases"] == [texts[event["index"]].upper()]
+    sizes = [len(texts) for kind, texts in engine.calls]
+    assert sizes == [3, 3, 2]
+
+
+def test_stream_many_lets_other_requests_in_between():
+    engine = FakeParaphraser(delay=0.05)
+    scheduler = BatchScheduler(engine, max_batch=2, max_wait=0.0)
+    texts = [f"bulk {i}" for i in range(8)]
+
+    bulk = threading.Thread(target=lambda: list(scheduler.stream_many(texts)))
+    bulk.start()
+    time.sleep(0.02)
+    assert scheduler.paraphrase("interactive", 1) == ["INTERACTIVE"]
+    bulk.join(5)
+
+    kinds = [kind for kind, _ in engine.calls]
+    assert kinds.index("many") < len(kinds) - 1
+
+
+def test_a_failing_chunk_only_fails_its_own_texts():
+    engine = FakeParaphraser()
+    scheduler = BatchScheduler(engine, max_batch=2)
+    texts = ["a1", "b2", "fail", "c3d4", "e5f6g"]
+
+    events = {event["index"]: event for event in scheduler.stream_many(texts)}
+
+    # "fail" shares its chunk with "c3d4", which is never reached
+    assert events[2]["error"] == events[3]["error"] == "cannot paraphrase 'fail'"
+    for index in (0, 1, 4):
+        assert events[index]["paraphrases"] == [texts[index].upper()]
+
+
+def test_seeded_stream_many_runs_each_text_on_its_own():
+    engine = FakeParaphraser()
+    engine.results[("paraphrase", "cached text", 5)] = ["from cache"]
+    scheduler = BatchScheduler(engine, max_batch=8)
+    texts = ["first text", "cached text", "second"]
+
+    events = {event["index"]: event for event in scheduler.stream_many(texts, 2, seed=5)}
+
+    assert events[1]["paraphrases"] == ["from cache"]
+    assert events[0]["paraphrases"] == ["first text 0", "first text 1"]
+    assert sorted(texts for kind, texts in engine.calls) == [["first text"], ["second"]]
+    assert all(kind == "stream" for kind, _ in engine.calls)
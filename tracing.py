@@ -0,0 +1,119 @@
+"""
+Tracing hooks for AIParaphraser: timed spans for each stage of a call
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+
+class Span:
+    """
+    One timed piece of work.
+
+    Calls to AIParaphraser's public methods produce a root span named after
+    the call (paraphrase, paragraph, many, styles, batch); each stage inside
+    it (tokenize, encode, generate, decode, dedup, assemble) produces a child
+    span whose `parent` is that root span.
+    """
+
+    __slots__ = ("name", "start", "end", "attributes", "parent", "thread_id")
+
+    def __init__(
+        self,
+        name: str,
+        start: float,
+        attributes: Optional[Dict[str, Any]] = None,
+        parent: Optional["Span"] = None,
+    ):
+        self.name = name
+        # time.perf_counter() seconds
+        self.start = start
+        self.end: Optional[float] = None
+        self.attributes = attributes if attributes is not None else {}
+        self.parent = parent
+        self.thread_id = threading.get_ident()
+
+    @property
+    def duration(self) -> float:
+        """Seconds between start and end (0 while the span is open)."""
+        return self.end - self.start if self.end is not None else 0.0
+
+    def __repr__(self):
+        return f"Span({self.name!r}, {self.duration * 1000:.2f}ms, {self.attributes})"
+
+
+class Tracer:
+    """
+    Receives the spans of an AIParaphraser.
+
+    Subclasses override `on_span`, which is called once per span when it
+    ends, children before their parent, from whichever thread ran the work.
+    """
+
+    def on_span(self, span: Span) -> None:
+        pass
+
+
+class CallbackTracer(Tracer):
+    """Tracer that passes every finished span to a function."""
+
+    def __init__(self, callback: Callable[[Span], None]):
+        self.callback = callback
+
+    def on_span(self, span: Span) -> None:
+        self.callback(span)
+
+
+class ChromeTraceRecorder(Tracer):
+    """
+    Records spans as Chrome trace events.
+
+    The saved file opens in chrome://tracing or https://ui.perfetto.dev,
+    with one row per thread and the stages nested under their call.
+    """
+
+    def __init__(self, max_events: Optional[int] = None):
+        """
+        Args:
+            max_events: Keep only the most recent events (None: keep all)
+        """
+        self._events: "deque[Dict[str, Any]]" = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        # Trace timestamps are microseconds since the recorder was created
+        self._origin = time.perf_counter()
+
+    def on_span(self, span: Span) -> None:
+        event = {
+            "name": span.name,
+            "cat": "call" if span.parent is None else "stage",
+            "ph": "X",
+            "ts": round((span.start - self._origin) * 1e6, 3),
+            "dur": round(span.duration * 1e6, 3),
+            "pid": os.getpid(),
+            "tid": span.thread_id,
+            "args": span.attributes,
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def events(self) -> List[Dict[str, Any]]:
+        """The recorded trace events, oldest first."""
+        with self._lock:
+            return list(self._events)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._events.clear()
+
+    def to_json(self) -> Dict[str, Any]:
+        """The trace in the Chrome trace-event JSON object format."""
+        return {"traceEvents": self.events(), "displayTimeUnit": "ms"}
+
+    def save(self, path: str) -> None:
+        """Write the trace to `path`."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f)
@@ -11,8 +11,13 @@ except ImportError:
     FLASK_AVAILABLE = False
     print("Flask not installed. Run: pip install flask flask-cors")
 
-from paraphraser import AIParaphraser
+from model_registry import model_registry
+from scheduler import Overloaded
+from serving import (
+    instrument, metrics_response, overloaded_response, paraphraser_from_env, scheduler_from_env,
+)
 import os
+import threading
 
 
 # HTML template for web interface
@@ -279,11 +284,66 @@ HTML_TEMPLATE = """
 if FLASK_AVAILABLE:
     app = Flask(__name__)
     CORS(app)  # Enable CORS for API access
+    instrument(app)
     
-    # Initialize paraphraser (loaded once at startup)
-    print("Loading AI model...")
-    paraphraser = AIParaphraser(model_name="t5-base")
-    print("Model loaded! Server ready.")
+    # The paraphraser is loaded once per process by init_paraphraser(): at
+    # startup in main(), or by the serve.py master before it forks workers.
+    # When another server imports `web_api:app`, the first /api/health check
+    # starts loading it in the background (see start_loading).
+    # It is configured through PARAPHRASER_* environment variables, see serving.py.
+    # Requests go through the scheduler, which batches concurrent ones together.
+    paraphraser = None
+    scheduler = None
+    _paraphraser_lock = threading.Lock()
+    _loader = None
+    _loader_lock = threading.Lock()
+    # Why the last background load failed, if it did
+    _load_error = None
+    
+    
+    def init_paraphraser(**options):
+        """Load the paraphraser configured by the environment (options override it)."""
+        global paraphraser, scheduler
+        print("Loading AI model...")
+        paraphraser = paraphraser_from_env(model_name='t5-base', **options)
+        scheduler = scheduler_from_env(paraphraser)
+        print("Model loaded! Server ready.")
+        return paraphraser
+    
+    
+    def get_paraphraser():
+        """Return the loaded paraphraser, loading it on first use."""
+        if paraphraser is None:
+            with _paraphraser_lock:
+                if paraphraser is None:
+                    init_paraphraser()
+        return paraphraser
+    
+    
+    def start_loading():
+        """Load the paraphraser in a background thread, once."""
+        global _loader
+        with _loader_lock:
+            if paraphraser is None and (_loader is None or not _loader.is_alive()):
+                _loader = threading.Thread(target=_load, name="paraphraser-loader", daemon=True)
+                _loader.start()
+    
+    
+    def _load():
+        global _load_error
+        try:
+            get_paraphraser()
+            _load_error = None
+        except Exception as e:
+            # Reported by /api/health, which tries again on the next check
+            print(f"Loading the model failed: {e}")
+            _load_error = e
+    
+    
+    def get_scheduler():
+        """Return the request scheduler, loading the paraphraser on first use."""
+        get_paraphraser()
+        return scheduler
     
     
     @app.route('/')
@@ -306,6 +366,7 @@ if FLASK_AVAILABLE:
             temperature = data.get('temperature', 1.5)
             diversity_penalty = data.get('diversity_penalty', 1.0)
             max_length = data.get('max_length', 128)
+            seed = data.get('seed')  # Optional: reproducible (cacheable) output
             
             # Validate parameters
             if not text.strip():
@@ -314,13 +375,17 @@ if FLASK_AVAILABLE:
             if num_paraphrases < 1 or num_paraphrases > 20:
                 return jsonify({'error': 'num_paraphrases must be between 1 and 20'}), 400
             
+            if seed is not None and not isinstance(seed, int):
+                return jsonify({'error': 'seed must be an integer'}), 400
+            
             # Generate paraphrases
-            paraphrases = paraphraser.paraphrase(
+            paraphrases = get_scheduler().paraphrase(
                 text,
                 num_paraphrases=num_paraphrases,
                 temperature=temperature,
                 diversity_penalty=diversity_penalty,
-                max_length=max_length
+                max_length=max_length,
+                seed=seed
             )
             
             return jsonify({
@@ -329,14 +394,43 @@ if FLASK_AVAILABLE:
                 'count': len(paraphrases)
             })
         
+        except Overloaded as e:
+            return overloaded_response(e)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
     
     @app.route('/api/health', methods=['GET'])
     def health():
-        """Health check endpoint"""
-        return jsonify({'status': 'healthy', 'model': 't5-base'})
+        """Health check endpoint (503 while loading, warming up or overloaded)"""
+        if paraphraser is None or not paraphraser.ready:
+            # Imported by another server, nothing has loaded the model yet
+            start_loading()
+            if _load_error is not None:
+                return jsonify({'status': 'failed', 'error': str(_load_error)}), 503
+            return jsonify({'status': 'starting'}), 503
+        stats = scheduler.stats()
+        saturated = stats['saturated']
+        body = jsonify({
+            'status': 'overloaded' if saturated else 'healthy',
+            'model': paraphraser.model_name,
+            'quantize': paraphraser.quantize,
+            'backend': paraphraser.backend,
+            'compile_mode': paraphraser.compile_mode,
+            'threads': paraphraser.threads,
+            'resident_models': model_registry.stats(),
+            'model_size_mb': round(paraphraser.model_size_mb, 1),
+            'batching': stats
+        })
+        if saturated:
+            return body, 503, {'Retry-After': str(scheduler.retry_after())}
+        return body
+    
+    
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus metrics for this process (stage latencies, tokens, queue, caches)"""
+        return metrics_response(paraphraser, scheduler)
 
 
 def main():
@@ -357,6 +451,8 @@ def main():
     print("\nPress Ctrl+C to stop the server")
     print("=" * 80 + "\n")
     
+    init_paraphraser()
+    
     # Run the Flask app
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)